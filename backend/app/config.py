@@ -0,0 +1,96 @@
+import os
+from dotenv import load_dotenv
+
+# Load variables from your .env file
+load_dotenv()
+
+# --- Navigation ---
+# Reference photo/description embeddings are stored here so restarts only encode new or changed photos.
+NAV_EMBEDDING_CACHE_PATH = os.getenv("NAV_EMBEDDING_CACHE_PATH", "app/navigation_cache/reference_embeddings.pt")
+# Reference photos are encoded this many at a time; decoding/preprocessing uses a small thread pool.
+NAV_IMAGE_BATCH_SIZE = int(os.getenv("NAV_IMAGE_BATCH_SIZE", "16"))
+NAV_PREPROCESS_WORKERS = int(os.getenv("NAV_PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Concurrent /navigation/find-path/ uploads are gathered for up to this many milliseconds (or until the
+# batch is full) and matched together in one forward pass per model.
+NAV_BATCH_WINDOW_MS = float(os.getenv("NAV_BATCH_WINDOW_MS", "10"))
+NAV_MAX_BATCH_SIZE = int(os.getenv("NAV_MAX_BATCH_SIZE", "8"))
+# Navigation inference runs on its own bounded thread pool. Once this many requests are waiting for it,
+# new uploads get a 503 with a Retry-After header instead of piling up.
+NAV_INFERENCE_WORKERS = int(os.getenv("NAV_INFERENCE_WORKERS", "1"))
+NAV_MAX_QUEUE_DEPTH = int(os.getenv("NAV_MAX_QUEUE_DEPTH", "32"))
+NAV_RETRY_AFTER_SECONDS = int(os.getenv("NAV_RETRY_AFTER_SECONDS", "2"))
+# How navigation models are loaded:
+#   "eager"      - during startup, before the app accepts requests
+#   "background" - on a background thread once the app starts (default)
+#   "lazy"       - on the first navigation request
+#   "off"        - navigation routes are not mounted and the models are never imported
+NAVIGATION_MODE = os.getenv("NAVIGATION_MODE", "background").strip().lower()
+# How long a navigation request waits for a warming worker before giving up with a 503
+NAV_WARM_UP_WAIT_SECONDS = float(os.getenv("NAV_WARM_UP_WAIT_SECONDS", "30"))
+# Uploaded navigation photos are decoded in memory. Larger uploads are rejected, and images are shrunk
+# to NAV_MAX_IMAGE_SIDE pixels (longest side) while decoding so huge phone photos stay cheap.
+NAV_MAX_UPLOAD_BYTES = int(os.getenv("NAV_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+NAV_MAX_IMAGE_PIXELS = int(os.getenv("NAV_MAX_IMAGE_PIXELS", str(64_000_000)))
+NAV_MAX_IMAGE_SIDE = int(os.getenv("NAV_MAX_IMAGE_SIDE", "640"))
+# Every reference photo is indexed individually. "flat" scores all of them exactly; "ivf" clusters them
+# and only scans the closest clusters, which only kicks in once there are NAV_IVF_MIN_VECTORS photos.
+# A location's image score is the mean of its NAV_PER_LOCATION_TOP_K best-matching photos.
+NAV_INDEX_TYPE = os.getenv("NAV_INDEX_TYPE", "flat").strip().lower()
+NAV_INDEX_SEARCH_K = int(os.getenv("NAV_INDEX_SEARCH_K", "64"))
+NAV_PER_LOCATION_TOP_K = int(os.getenv("NAV_PER_LOCATION_TOP_K", "1"))
+NAV_IVF_MIN_VECTORS = int(os.getenv("NAV_IVF_MIN_VECTORS", "1000"))
+NAV_IVF_NLIST = int(os.getenv("NAV_IVF_NLIST", "0"))    # 0 = sqrt(number of photos)
+NAV_IVF_NPROBE = int(os.getenv("NAV_IVF_NPROBE", "0"))  # 0 = a quarter of the lists
+# Inference profile for the CLIP ensemble:
+#   NAV_PRECISION     - "autocast" (default mixed precision), "fp32", "bf16" (falls back to fp32 without CPU
+#                       support) or "int8" (dynamic quantization of the image tower's linear layers, CPU only)
+#   NAV_TORCH_THREADS - intra-op threads for torch (0 = torch's default)
+#   NAV_MODELS        - which ensemble members to load, e.g. "laion" to run a single model
+NAV_PRECISION = os.getenv("NAV_PRECISION", "autocast").strip().lower()
+NAV_TORCH_THREADS = int(os.getenv("NAV_TORCH_THREADS", "0"))
+NAV_MODELS = [name.strip() for name in os.getenv("NAV_MODELS", "laion,openai").split(",") if name.strip()]
+# Recent match results are kept in an LRU cache keyed by the upload's SHA-256, so retries of the same photo
+# skip the models (0 disables it). With NAV_MATCH_CACHE_PERCEPTUAL, photos whose 64-bit difference hash is
+# within NAV_MATCH_CACHE_MAX_DISTANCE bits of a cached one (e.g. the same picture re-compressed) count too.
+NAV_MATCH_CACHE_SIZE = int(os.getenv("NAV_MATCH_CACHE_SIZE", "1024"))
+NAV_MATCH_CACHE_PERCEPTUAL = os.getenv("NAV_MATCH_CACHE_PERCEPTUAL", "false").strip().lower() in ("1", "true", "yes")
+NAV_MATCH_CACHE_MAX_DISTANCE = int(os.getenv("NAV_MATCH_CACHE_MAX_DISTANCE", "4"))
+# Campus map used to build step-by-step routes (places, connectors, floors and walking costs)
+NAV_CAMPUS_GRAPH_PATH = os.getenv("NAV_CAMPUS_GRAPH_PATH", "app/campus_graph.json")
+# The location catalogue (names, descriptions and reference photos) is read from this file. It can be
+# edited through the /navigation/admin API or by hand; with NAV_CATALOGUE_WATCH_SECONDS > 0 the catalogue,
+# campus map and photo folder are polled and changes are re-indexed without a restart.
+NAV_LOCATIONS_PATH = os.getenv("NAV_LOCATIONS_PATH", "app/locations_data.json")
+NAV_PHOTOS_DIR = os.getenv("NAV_PHOTOS_DIR", "app/database_photos")
+NAV_CATALOGUE_WATCH_SECONDS = float(os.getenv("NAV_CATALOGUE_WATCH_SECONDS", "0"))
+
+# --- Chat ---
+# Every WebSocket connection has a send queue of this many events. A client that falls this far behind
+# (or takes longer than the timeout to accept one event) is disconnected and has to reconnect and
+# catch up over /chat/messages.
+CHAT_WS_QUEUE_SIZE = int(os.getenv("CHAT_WS_QUEUE_SIZE", "256"))
+CHAT_WS_SEND_TIMEOUT_SECONDS = float(os.getenv("CHAT_WS_SEND_TIMEOUT_SECONDS", "10"))
+# How chat events reach the WebSocket connections: "memory" delivers them within this process only. A
+# broker shared by several server workers can be plugged in with chat_hub.set_broker().
+CHAT_BROKER = os.getenv("CHAT_BROKER", "memory").strip().lower()
+# Chat search ranks (BM25) the newest CHAT_SEARCH_CANDIDATES messages that match, and estimates how common
+# each search word is from the newest CHAT_SEARCH_IDF_WINDOW messages, which keeps searches fast however
+# large the history grows.
+CHAT_SEARCH_CANDIDATES = int(os.getenv("CHAT_SEARCH_CANDIDATES", "500"))
+CHAT_SEARCH_IDF_WINDOW = int(os.getenv("CHAT_SEARCH_IDF_WINDOW", "20000"))
+# Chat presence is kept in memory: a user goes offline CHAT_PRESENCE_TTL_SECONDS after their last heartbeat.
+# Status changes are written to the user directory in one batch every CHAT_PRESENCE_PERSIST_SECONDS
+# (0 keeps presence in memory only).
+CHAT_PRESENCE_TTL_SECONDS = float(os.getenv("CHAT_PRESENCE_TTL_SECONDS", "60"))
+CHAT_PRESENCE_PERSIST_SECONDS = float(os.getenv("CHAT_PRESENCE_PERSIST_SECONDS", "30"))
+# The chat user directory (app/users_data.json) is served from memory and written back at most once every
+# CHAT_JSON_FLUSH_SECONDS, however many changes arrive in between (0 writes every change right away).
+CHAT_JSON_FLUSH_SECONDS = float(os.getenv("CHAT_JSON_FLUSH_SECONDS", "1"))
+# Chat attachments are stored by content hash under CHAT_ATTACHMENTS_DIR (identical uploads share one
+# file). Thumbnails (longest side CHAT_THUMBNAIL_SIZE pixels) are made in the background by
+# CHAT_THUMBNAIL_WORKERS threads, for images of at most CHAT_THUMBNAIL_MAX_PIXELS pixels.
+CHAT_ATTACHMENTS_DIR = os.getenv("CHAT_ATTACHMENTS_DIR", "app/chat_attachments")
+CHAT_ATTACHMENT_MAX_BYTES = int(os.getenv("CHAT_ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+CHAT_THUMBNAIL_SIZE = int(os.getenv("CHAT_THUMBNAIL_SIZE", "320"))
+CHAT_THUMBNAIL_WORKERS = int(os.getenv("CHAT_THUMBNAIL_WORKERS", "2"))
+CHAT_THUMBNAIL_MAX_PIXELS = int(os.getenv("CHAT_THUMBNAIL_MAX_PIXELS", str(64_000_000)))
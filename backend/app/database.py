@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -13,6 +13,15 @@ DATABASE_URL = "sqlite:///./ace_app.db"
 # For SQLite, we need to add some additional configuration
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+    # WAL lets readers run while a write is in progress, and busy_timeout makes concurrent writers
+    # (threads or server workers) wait for the lock instead of failing with "database is locked".
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
 else:
     engine = create_engine(DATABASE_URL)
 
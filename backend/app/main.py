@@ -1,16 +1,23 @@
 import json
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
-from .models import user_models, library_models
+from .models import user_models, library_models, chat_models
 
 # --- Import necessary database and model components ---
 from .database import engine, SessionLocal
 from .models import user_models
-from .routes import auth_routes, canteen_routes, management_routes, timetable_routes, feedback_routes, library_routes, navigation_routes, chat_routes
+from .routes import auth_routes, canteen_routes, management_routes, timetable_routes, feedback_routes, library_routes, chat_routes
+from .config import NAVIGATION_MODE, NAV_CATALOGUE_WATCH_SECONDS
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+# Navigation pulls in torch/OpenCLIP, so it is only imported when enabled
+NAVIGATION_ENABLED = NAVIGATION_MODE != "off"
+if NAVIGATION_ENABLED:
+    from .routes import navigation_routes
+
+def seed_database():
+    """Seeds roles, users, the menu and library books into an empty database. Safe to call more than once."""
     print("Application startup: Checking database...")
     db = SessionLocal()
     try:
@@ -97,20 +104,58 @@ async def lifespan(app: FastAPI):
                 print(f"An error occurred during library seeding: {e}")
         else:
             print("Library books already exist. Skipping.")
+    finally:
+        db.close()
 
-        # --- Initialize Navigation Models ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    seed_database()
+    chat_routes.initialize_chat_data()
+    chat_routes.start_presence()
+
+    # --- Precompute Campus Routes ---
+    if NAVIGATION_ENABLED:
+        try:
+            navigation_routes.initialize_routes()
+        except Exception as e:
+            print(f"Warning: Failed to load the campus map: {e}")
+
+    if NAVIGATION_ENABLED and NAV_CATALOGUE_WATCH_SECONDS > 0:
+        print(f"Watching the location catalogue for changes every {NAV_CATALOGUE_WATCH_SECONDS}s.")
+        navigation_routes.start_catalogue_watcher()
+
+    # --- Initialize Navigation Models ---
+    if NAVIGATION_MODE == "eager":
         print("Initializing navigation models...")
         try:
-            from .routes.navigation_routes import initialize_navigation_models
-            initialize_navigation_models()
+            navigation_routes.initialize_navigation_models()
             print("Navigation models initialized successfully!")
         except Exception as e:
             print(f"Warning: Failed to initialize navigation models: {e}")
+    elif NAVIGATION_MODE == "background":
+        print("Navigation models will load in the background.")
+        navigation_routes.start_navigation_warm_up()
+    elif NAVIGATION_MODE == "lazy":
+        print("Navigation models will load on the first navigation request.")
+    else:
+        print("Navigation is disabled (NAVIGATION_MODE=off).")
 
-    finally:
-        db.close()
-    
     yield
+
+    if NAVIGATION_ENABLED:
+        navigation_routes.stop_catalogue_watcher()
+        try:
+            from .services.navigation_batcher import inference_batcher
+            from .services import navigation_service
+            await inference_batcher.shutdown()
+            navigation_service.shutdown_preprocess_pool()
+        except Exception as e:
+            print(f"Warning: Failed to stop navigation batcher: {e}")
+    from .services.chat_hub import chat_hub
+    await chat_hub.close()
+    chat_routes.stop_presence()
+    from .services.chat_attachments import attachment_storage
+    attachment_storage.shutdown()
     print("Application shutdown.")
 
 
@@ -118,6 +163,7 @@ async def lifespan(app: FastAPI):
 # --- Create the database tables ---
 user_models.Base.metadata.create_all(bind=engine)
 library_models.Base.metadata.create_all(bind=engine)
+chat_models.Base.metadata.create_all(bind=engine)
 
 # --- Initialize the FastAPI app with the lifespan event ---
 app = FastAPI(
@@ -144,9 +190,33 @@ app.include_router(management_routes.router) # <-- ADD THIS LINE
 app.include_router(timetable_routes.router)
 app.include_router(feedback_routes.router) 
 app.include_router(library_routes.router)
-app.include_router(navigation_routes.router)
+if NAVIGATION_ENABLED:
+    app.include_router(navigation_routes.router)
 app.include_router(chat_routes.router) 
 
 @app.get("/", tags=["Root"])
 def read_root():
-    return {"message": "Welcome to the ACE 2.0 Backend API!"}
\ No newline at end of file
+    return {"message": "Welcome to the ACE 2.0 Backend API!"}
+
+@app.get("/health/ready", tags=["Root"])
+def readiness():
+    """
+    Readiness probe for the load balancer. Reports whether navigation is warm; in eager/background mode a
+    worker whose models are still loading (or failed to load) answers 503 so traffic is routed elsewhere.
+    Lazy workers are meant to take traffic while cold, so they stay ready.
+    """
+    if not NAVIGATION_ENABLED:
+        navigation = {"mode": NAVIGATION_MODE, "state": "disabled", "warm": False}
+    else:
+        from .services import navigation_service
+        navigation = {
+            "mode": NAVIGATION_MODE,
+            **navigation_service.navigation_status,
+            "profile": navigation_service.inference_profile,
+            "warm": navigation_service.is_ready(),
+        }
+    ready = navigation["warm"] or NAVIGATION_MODE in ("off", "lazy")
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "warming_up", "navigation": navigation}
+    )
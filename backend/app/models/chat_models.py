@@ -0,0 +1,59 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, TEXT, Boolean, Index
+from ..database import Base
+
+# Chat rooms and messages. Chat user ids are the string ids of the chat user directory
+# (app/users_data.json), not the integer ids of the `users` table.
+
+class ChatRoom(Base):
+    __tablename__ = "chat_rooms"
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    type = Column(String, nullable=False, default="group")
+    created_at = Column(String, nullable=False)  # ISO 8601, as returned by the API
+    # Kept up to date on every send, so listing rooms doesn't search their history
+    last_message_seq = Column(Integer)  # chat_messages.seq
+
+class ChatParticipant(Base):
+    __tablename__ = "chat_participants"
+    room_id = Column(String, ForeignKey("chat_rooms.id"), primary_key=True)
+    user_id = Column(String, primary_key=True, index=True)
+    position = Column(Integer, nullable=False, default=0)  # Keeps the participant order of the room
+    # Read watermark: the participant has read every message of the room with seq <= last_read_seq
+    last_read_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # Messages after the watermark sent by others, updated on every send and read
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    # `seq` is the insertion order; `id` is the public message id
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(String, unique=True, nullable=False, index=True)
+    room_id = Column(String, ForeignKey("chat_rooms.id"), nullable=False)
+    sender_id = Column(String, nullable=False)
+    sender_name = Column(String)
+    sender_avatar = Column(String)
+    content = Column(TEXT, nullable=False)
+    timestamp = Column(String, nullable=False)  # ISO 8601, as returned by the API
+    # Read state from the JSON store, only used to set the initial read watermarks on import; reads are
+    # now tracked per participant (ChatParticipant.last_read_seq)
+    is_read = Column(Boolean, nullable=False, default=False)
+    message_type = Column(String, nullable=False, default="text")
+    # Files are stored outside the database; a message only references its attachment
+    attachment_id = Column(String, ForeignKey("chat_attachments.id"))
+
+    # A room's history is read in (timestamp, seq) order, so pages are index range scans
+    __table_args__ = (Index("ix_chat_messages_room_timestamp", "room_id", "timestamp", "seq"),)
+
+class ChatAttachment(Base):
+    __tablename__ = "chat_attachments"
+    # One row per upload; uploads of the same bytes share one stored file (`sha256`, see
+    # services/chat_attachments.py)
+    id = Column(String, primary_key=True)
+    sha256 = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False)  # File name as uploaded
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    uploader_id = Column(String, nullable=False)
+    created_at = Column(String, nullable=False)  # ISO 8601
+    width = Column(Integer)  # Images only
+    height = Column(Integer)
@@ -1,24 +1,67 @@
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
 import json
 import os
+import tempfile
+import threading
+import time
 from datetime import datetime, timezone
 from typing import List, Optional
 import uuid
 
-# Chat data storage
+from ..config import CHAT_ATTACHMENT_MAX_BYTES, CHAT_SEARCH_CANDIDATES
+from ..database import SessionLocal, engine, get_db
+from ..models import chat_models
+from ..services import chat_store
+from ..services.chat_attachments import UploadError, attachment_storage
+from ..services.chat_hub import chat_hub
+from ..services.json_store import JsonFileStore
+from ..services.presence import presence
+
+# Chat data storage. Rooms and messages are stored in the database; these JSON files are only read to
+# seed it. The user directory lives in USERS_FILE, which is read once and written back behind the requests
+# (users_store); online status is kept in memory (services/presence.py) and saved to it periodically.
 CHAT_DATA_FILE = "app/chat_data.json"
 MESSAGES_FILE = "app/messages_data.json"
 USERS_FILE = "app/users_data.json"
 
+users_store = JsonFileStore(USERS_FILE)
+
 router = APIRouter(
     prefix="/chat",
     tags=["Chat"]
 )
 
-# Initialize chat data if files don't exist
+# --- Initialization (once, at startup) ---
+def _create_if_absent(file_path: str, data: dict):
+    """
+    Writes a seed file unless it exists. The file is written in full under a temporary name and then
+    hard-linked into place, which fails if the file is already there: when several workers start at once,
+    exactly one seed wins and nobody ever reads a half-written file.
+    """
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".seed-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, file_path)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(temp_path)
+
 def initialize_chat_data():
-    """Initialize chat data files with sample data"""
+    """
+    Prepares chat storage: writes the sample JSON files if they are missing and imports them into the
+    database. Called once from the app lifespan (and by app.serve before it forks), never per request.
+    """
     
     # Sample users data
     if not os.path.exists(USERS_FILE):
@@ -80,8 +123,7 @@ def initialize_chat_data():
                 }
             ]
         }
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users_data, f, indent=2)
+        _create_if_absent(USERS_FILE, users_data)
 
     # Sample chat rooms data
     if not os.path.exists(CHAT_DATA_FILE):
@@ -113,8 +155,7 @@ def initialize_chat_data():
                 }
             ]
         }
-        with open(CHAT_DATA_FILE, 'w') as f:
-            json.dump(chat_data, f, indent=2)
+        _create_if_absent(CHAT_DATA_FILE, chat_data)
 
     # Sample messages data
     if not os.path.exists(MESSAGES_FILE):
@@ -178,8 +219,53 @@ def initialize_chat_data():
                 }
             ]
         }
-        with open(MESSAGES_FILE, 'w') as f:
-            json.dump(messages_data, f, indent=2)
+        _create_if_absent(MESSAGES_FILE, messages_data)
+
+    import_chat_data()
+
+_chat_data_imported = False
+_chat_import_lock = threading.Lock()
+
+def import_chat_data(attempts=5):
+    """Imports the JSON rooms and messages into the chat tables, once per process"""
+    global _chat_data_imported
+    with _chat_import_lock:
+        if _chat_data_imported:
+            return
+        for attempt in range(1, attempts + 1):
+            try:
+                _import_chat_data()
+                break
+            except (IntegrityError, OperationalError) as e:
+                # Another worker starting at the same time got there first (its schema change or import
+                # committed while ours was in progress); with its work visible, a retry skips that step.
+                # Every step can be lost once, hence several attempts.
+                if attempt == attempts:
+                    raise
+                print(f"Chat storage was being initialized by another process ({e.__class__.__name__}); retrying.")
+                time.sleep(0.1 * attempt)
+        _chat_data_imported = True
+
+def _import_chat_data():
+    chat_models.Base.metadata.create_all(bind=engine, tables=[
+        chat_models.ChatRoom.__table__, chat_models.ChatParticipant.__table__, chat_models.ChatMessage.__table__,
+        chat_models.ChatAttachment.__table__
+    ])
+    columns_added = chat_store.upgrade_schema(engine)
+    chat_store.create_search_index(engine)
+    db = SessionLocal()
+    try:
+        if columns_added & {"chat_rooms.last_message_seq", "chat_participants.last_read_seq", "chat_participants.unread_count"}:
+            # Read watermarks added to an existing table start from the old per-message read flags
+            chat_store.rebuild_room_summaries(
+                db, watermarks_from_read_flags="chat_participants.last_read_seq" in columns_added
+            )
+            db.commit()
+        imported = chat_store.import_json_data(db, load_data(CHAT_DATA_FILE), load_data(MESSAGES_FILE))
+        if imported["rooms"] or imported["messages"]:
+            print(f"Imported {imported['rooms']} chat rooms and {imported['messages']} messages into the database.")
+    finally:
+        db.close()
 
 def load_data(file_path: str):
     """Load data from JSON file"""
@@ -188,49 +274,70 @@ def load_data(file_path: str):
     with open(file_path, 'r') as f:
         return json.load(f)
 
-def save_data(file_path: str, data: dict):
-    """Save data to JSON file"""
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=2)
+_users_cache = {"version": None, "by_id": {}}
+
+def get_users_by_id():
+    """The chat user directory as a dict by user id, built from the in-memory copy of USERS_FILE"""
+    users_data, version = users_store.snapshot()
+    if _users_cache["version"] != version:
+        _users_cache["by_id"] = {u["id"]: u for u in users_data.get("users", [])}
+        _users_cache["version"] = version
+    return _users_cache["by_id"]
+
+# --- Presence ---
+def with_presence(user):
+    """A user directory entry with its live online status"""
+    is_online, last_seen = presence.status(user["id"])
+    return {**user, "isOnline": is_online, "lastSeen": last_seen or user.get("lastSeen")}
+
+def _publish_presence(user_id, is_online, last_seen):
+    db = SessionLocal()
+    try:
+        rooms = [room.id for room in chat_store.get_user_rooms(db, user_id)]
+    finally:
+        db.close()
+    chat_hub.publish_to_rooms(rooms, {
+        "type": "presence",
+        "data": {"userId": user_id, "isOnline": is_online, "lastSeen": last_seen}
+    })
+
+def _save_presence(changes):
+    """Applies a batch of presence changes ({user_id: (is_online, last_seen)}) to USERS_FILE"""
+    def apply(users_data):
+        for user in users_data.get("users", []):
+            if user["id"] in changes:
+                user["isOnline"], user["lastSeen"] = changes[user["id"]]
+    users_store.update(apply)
+
+presence.subscribe(_publish_presence)
+presence.set_persister(_save_presence)
+
+def start_presence():
+    """Loads the saved online status and starts expiring users whose heartbeats stop"""
+    presence.load(get_users_by_id().values())
+    presence.start()
+
+def stop_presence():
+    """Stops the presence sweeper and writes out everything still pending for USERS_FILE"""
+    presence.stop()
+    users_store.close()
 
 @router.get("/rooms/{user_id}")
-async def get_chat_rooms(user_id: str):
+def get_chat_rooms(user_id: str, db: Session = Depends(get_db)):
     """Get all chat rooms for a user"""
-    initialize_chat_data()
-    
-    chat_data = load_data(CHAT_DATA_FILE)
-    users_data = load_data(USERS_FILE)
-    messages_data = load_data(MESSAGES_FILE)
+    users_by_id = get_users_by_id()
     
     rooms = []
-    for room in chat_data.get("rooms", []):
-        if user_id in room["participants"]:
-            # Get participants details
-            participants = []
-            for participant_id in room["participants"]:
-                user = next((u for u in users_data.get("users", []) if u["id"] == participant_id), None)
-                if user:
-                    participants.append(user)
-            
-            # Get last message
-            last_message = None
-            room_messages = [m for m in messages_data.get("messages", []) if m["roomId"] == room["id"]]
-            if room_messages:
-                last_message = max(room_messages, key=lambda x: x["timestamp"])
-            
-            # Count unread messages
-            unread_count = len([m for m in room_messages if not m["isRead"] and m["senderId"] != user_id])
-            
-            room_data = {
-                "id": room["id"],
-                "name": room["name"],
-                "type": room["type"],
-                "participants": participants,
-                "lastMessage": last_message,
-                "unreadCount": unread_count
-            }
-            rooms.append(room_data)
+    for room, last_message, member, participant_ids in chat_store.get_room_summaries(db, user_id):
+        room_data = {
+            "id": room.id,
+            "name": room.name,
+            "type": room.type,
+            "participants": [with_presence(users_by_id[p]) for p in participant_ids if p in users_by_id],
+            "lastMessage": chat_store.message_to_dict(last_message, member.last_read_seq) if last_message else None,
+            "unreadCount": member.unread_count
+        }
+        rooms.append(room_data)
     
     return JSONResponse(content={
         "success": True,
@@ -239,86 +346,134 @@ async def get_chat_rooms(user_id: str):
     })
 
 @router.get("/messages/{room_id}")
-async def get_chat_messages(room_id: str, limit: int = Query(50, ge=1, le=100)):
-    """Get messages for a specific chat room"""
-    initialize_chat_data()
+def get_chat_messages(
+    room_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = Query(None, description="Message id: return the messages just before it"),
+    after: Optional[str] = Query(None, description="Message id: return the messages just after it"),
+    user_id: Optional[str] = Query(None, description="Report isRead for this user"),
+    db: Session = Depends(get_db)
+):
+    """
+    Get messages for a specific chat room, oldest first. Without a cursor this is the newest `limit`
+    messages; pass `before` (the oldest id shown) to page back through history, or `after` (the newest id
+    shown) to fetch what arrived since. `isRead` says whether `user_id` has read a message or, without a
+    user, whether every participant has.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    cursors = {}
+    for name, message_id in (("before", before), ("after", after)):
+        if message_id:
+            cursor = chat_store.get_message(db, message_id)
+            if not cursor or cursor.room_id != room_id:
+                raise HTTPException(status_code=400, detail=f"Unknown '{name}' message for this room")
+            cursors[name] = cursor
     
-    messages_data = load_data(MESSAGES_FILE)
-    room_messages = [m for m in messages_data.get("messages", []) if m["roomId"] == room_id]
+    room_messages, has_more = chat_store.get_messages_page(db, room_id, limit, **cursors)
+    if user_id:
+        member = chat_store.get_participant(db, room_id, user_id)
+        read_up_to = member.last_read_seq if member else 0
+    else:
+        read_up_to = chat_store.read_by_everyone_up_to(db, room_id)
     
-    # Sort by timestamp (newest first) and limit
-    room_messages.sort(key=lambda x: x["timestamp"], reverse=True)
-    room_messages = room_messages[:limit]
+    return JSONResponse(content={
+        "success": True,
+        "data": [chat_store.message_to_dict(m, read_up_to) for m in room_messages],
+        "paging": {
+            "before": room_messages[0].id if room_messages else before,
+            "after": room_messages[-1].id if room_messages else after,
+            "hasMore": has_more
+        },
+        "message": "Messages loaded successfully"
+    })
+
+@router.get("/search")
+def search_chat_messages(
+    user_id: str = Query(..., description="Only rooms this user is in are searched"),
+    q: str = Query(..., min_length=1, max_length=200),
+    room_id: Optional[str] = Query(None, description="Search a single room"),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Full-text search over the messages of the user's rooms, best matches first, with highlighted snippets.
+    Only the most recent CHAT_SEARCH_CANDIDATES matches are ranked, so pages end at that window.
+    """
+    if offset + limit > CHAT_SEARCH_CANDIDATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only the {CHAT_SEARCH_CANDIDATES} most recent matches are searched; narrow the query instead of paging further."
+        )
+    read_up_to = {
+        member.room_id: member.last_read_seq
+        for member in db.query(chat_models.ChatParticipant).filter(chat_models.ChatParticipant.user_id == user_id)
+    }
+    room_ids = [room_id] if room_id else list(read_up_to)
+    if room_id and room_id not in read_up_to:
+        raise HTTPException(status_code=404, detail="User is not in this chat room")
     
-    # Sort back to chronological order (oldest first)
-    room_messages.reverse()
+    results, has_more = chat_store.search_messages(db, room_ids, q, limit, offset)
     
     return JSONResponse(content={
         "success": True,
-        "data": room_messages,
-        "message": "Messages loaded successfully"
+        "data": [
+            {"message": chat_store.message_to_dict(message, read_up_to[message.room_id]), "snippet": snippet}
+            for message, snippet in results
+        ],
+        "paging": {"offset": offset, "limit": limit, "hasMore": has_more, "window": CHAT_SEARCH_CANDIDATES},
+        "message": "Search completed successfully"
     })
 
 @router.post("/send")
-async def send_chat_message(message_data: dict):
+def send_chat_message(message_data: dict, db: Session = Depends(get_db)):
     """Send a new message to a chat room"""
-    initialize_chat_data()
-    
     try:
         room_id = message_data.get("roomId")
         sender_id = message_data.get("senderId")
         content = message_data.get("content")
         message_type = message_data.get("messageType", "text")
+        attachment_id = message_data.get("attachmentId")
         
-        if not all([room_id, sender_id, content]):
+        if not all([room_id, sender_id, content or attachment_id]):
             raise HTTPException(status_code=400, detail="Missing required fields")
         
-        # Load existing data
-        messages_data = load_data(MESSAGES_FILE)
-        users_data = load_data(USERS_FILE)
-        
         # Find sender details
-        sender = next((u for u in users_data.get("users", []) if u["id"] == sender_id), None)
+        sender = get_users_by_id().get(sender_id)
         if not sender:
             raise HTTPException(status_code=404, detail="Sender not found")
+        if not chat_store.room_exists(db, room_id):
+            raise HTTPException(status_code=404, detail="Chat room not found")
+        if attachment_id:
+            # Uploaded beforehand with POST /chat/attachments; the message only keeps a reference
+            attachment = chat_store.get_attachment(db, attachment_id)
+            if not attachment or attachment.uploader_id != sender_id:
+                raise HTTPException(status_code=404, detail="Attachment not found")
+            message_type = "image" if attachment.width is not None else "file"
+            content = content or attachment.name
         
-        # Create new message
-        new_message = {
-            "id": str(uuid.uuid4()),
-            "roomId": room_id,
-            "senderId": sender_id,
-            "senderName": sender["name"],
-            "senderAvatar": sender.get("avatar"),
-            "content": content,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "isRead": False,
-            "messageType": message_type
-        }
-        
-        # Add message to data
-        if "messages" not in messages_data:
-            messages_data["messages"] = []
-        messages_data["messages"].append(new_message)
-        
-        # Save data
-        save_data(MESSAGES_FILE, messages_data)
+        # Append the message (a single INSERT)
+        new_message = chat_store.add_message(db, room_id, sender, content, message_type, attachment_id)
+        message = chat_store.message_to_dict(new_message)
+        chat_hub.publish(room_id, {"type": "message", "roomId": room_id, "data": message})
         
         return JSONResponse(content={
             "success": True,
-            "data": new_message,
+            "data": message,
             "message": "Message sent successfully"
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/users/online")
-async def get_online_users():
+def get_online_users():
     """Get list of online users"""
-    initialize_chat_data()
-    
-    users_data = load_data(USERS_FILE)
-    online_users = [u for u in users_data.get("users", []) if u.get("isOnline", False)]
+    users_by_id = get_users_by_id()
+    online_users = [with_presence(users_by_id[u]) for u in presence.online_user_ids() if u in users_by_id]
     
     return JSONResponse(content={
         "success": True,
@@ -327,51 +482,77 @@ async def get_online_users():
     })
 
 @router.post("/users/{user_id}/online")
-async def set_user_online(user_id: str, is_online: bool = True):
-    """Set user online status"""
-    initialize_chat_data()
-    
-    users_data = load_data(USERS_FILE)
+def set_user_online(
+    user_id: str,
+    is_online: Optional[bool] = Query(None),
+    status: Optional[dict] = Body(None, description='Or {"is_online": ...} in the body'),
+):
+    """
+    Set user online status. Calling this with is_online=true is also the presence heartbeat: clients
+    repeat it (or keep a chat WebSocket open) within CHAT_PRESENCE_TTL_SECONDS to stay online.
+    """
+    if is_online is None:
+        is_online = bool((status or {}).get("is_online", True))
+    if user_id not in get_users_by_id():
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Update user status
-    for user in users_data.get("users", []):
-        if user["id"] == user_id:
-            user["isOnline"] = is_online
-            user["lastSeen"] = datetime.now(timezone.utc).isoformat()
-            break
-    
-    save_data(USERS_FILE, users_data)
+    # In memory only; subscribers are told if the status changed, and it reaches USERS_FILE with the next batch
+    presence.set_status(user_id, is_online)
     
     return JSONResponse(content={
         "success": True,
         "message": f"User status updated to {'online' if is_online else 'offline'}"
     })
 
-@router.post("/messages/{message_id}/read")
-async def mark_message_read(message_id: str):
-    """Mark a message as read"""
-    initialize_chat_data()
-    
-    messages_data = load_data(MESSAGES_FILE)
-    
-    # Find and update message
-    for message in messages_data.get("messages", []):
-        if message["id"] == message_id:
-            message["isRead"] = True
-            break
+def _mark_read(db, room_id, user_id, up_to):
+    member = chat_store.mark_room_read(db, room_id, user_id, up_to)
+    if member is None:
+        raise HTTPException(status_code=404, detail="User is not in this chat room")
+    last_read = db.query(chat_models.ChatMessage.id).filter(chat_models.ChatMessage.seq == member.last_read_seq).scalar()
+    read_state = {"userId": user_id, "lastReadMessageId": last_read, "unreadCount": member.unread_count}
+    chat_hub.publish(room_id, {"type": "read", "roomId": room_id, "data": read_state})
+    return read_state
+
+@router.post("/rooms/{room_id}/read")
+def mark_room_read(
+    room_id: str,
+    user_id: str = Query(..., description="Whose messages to mark read"),
+    up_to: Optional[str] = Query(None, description="Message id; defaults to the room's latest message"),
+    db: Session = Depends(get_db)
+):
+    """Mark every message in a room read for a user, up to and including `up_to`"""
+    message = None
+    if up_to:
+        message = chat_store.get_message(db, up_to)
+        if not message or message.room_id != room_id:
+            raise HTTPException(status_code=404, detail="Message not found in this chat room")
     
-    save_data(MESSAGES_FILE, messages_data)
+    return JSONResponse(content={
+        "success": True,
+        "data": _mark_read(db, room_id, user_id, message),
+        "message": "Messages marked as read"
+    })
+
+@router.post("/messages/{message_id}/read")
+def mark_message_read(
+    message_id: str,
+    user_id: str = Query(..., description="Whose message to mark read"),
+    db: Session = Depends(get_db)
+):
+    """Mark a message (and everything before it in its room) as read for a user"""
+    message = chat_store.get_message(db, message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
     
     return JSONResponse(content={
         "success": True,
+        "data": _mark_read(db, message.room_id, user_id, message),
         "message": "Message marked as read"
     })
 
 @router.post("/rooms")
-async def create_chat_room(room_data: dict):
+def create_chat_room(room_data: dict, db: Session = Depends(get_db)):
     """Create a new chat room"""
-    initialize_chat_data()
-    
     try:
         name = room_data.get("name")
         room_type = room_data.get("type", "group")
@@ -380,31 +561,162 @@ async def create_chat_room(room_data: dict):
         if not name or not participants:
             raise HTTPException(status_code=400, detail="Name and participants are required")
         
-        chat_data = load_data(CHAT_DATA_FILE)
-        
-        new_room = {
-            "id": str(uuid.uuid4()),
-            "name": name,
-            "type": room_type,
-            "participants": participants,
-            "unreadCount": 0,
-            "createdAt": datetime.now(timezone.utc).isoformat()
-        }
-        
-        if "rooms" not in chat_data:
-            chat_data["rooms"] = []
-        chat_data["rooms"].append(new_room)
+        new_room = chat_store.create_room(db, name, room_type, participants)
+        db.commit()
+        room = chat_store.room_to_dict(new_room, list(dict.fromkeys(participants)))
         
-        save_data(CHAT_DATA_FILE, chat_data)
+        # Participants who are connected start receiving the new room's events right away
+        chat_hub.add_room_members(new_room.id, room["participants"])
+        chat_hub.publish(new_room.id, {"type": "room", "roomId": new_room.id, "data": room})
         
         return JSONResponse(content={
             "success": True,
-            "data": new_room,
+            "data": room,
             "message": "Chat room created successfully"
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Initialize data on startup
-initialize_chat_data()
+# --- Attachments ---
+@router.post("/attachments")
+async def upload_chat_attachment(request: Request, user_id: str = Query(..., description="Who is uploading")):
+    """
+    Upload a file for a chat message, as multipart/form-data with a "file" field. The upload is streamed to
+    disk (never held in memory) and stored by content, so identical files are stored once; images get a
+    thumbnail in the background. Send it with POST /chat/send and {"attachmentId": <id>}.
+    """
+    if user_id not in get_users_by_id():
+        raise HTTPException(status_code=404, detail="User not found")
+    # Obviously oversized uploads are refused before reading them (the limit is enforced while streaming too)
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > CHAT_ATTACHMENT_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"File is too large (max {CHAT_ATTACHMENT_MAX_BYTES // (1024 * 1024)} MB).")
+    try:
+        upload = await attachment_storage.receive(request)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    def save():
+        db = SessionLocal()
+        try:
+            return chat_store.attachment_to_dict(chat_store.add_attachment(db, upload, user_id))
+        finally:
+            db.close()
+    
+    attachment = await run_in_threadpool(save)
+    if upload["width"] is not None:
+        attachment_storage.request_thumbnail(upload["sha256"])
+    
+    return JSONResponse(content={
+        "success": True,
+        "data": attachment,
+        "message": "Attachment uploaded successfully"
+    })
+
+def _lookup_attachment(attachment_id):
+    db = SessionLocal()
+    try:
+        attachment = chat_store.get_attachment(db, attachment_id)
+    finally:
+        db.close()
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return attachment
+
+def _file_response(request, path, etag, media_type, filename=None, inline=True):
+    """
+    Serves a stored file in chunks. Range requests (for seeking and resuming) are answered by FileResponse;
+    stored files never change, so a matching If-None-Match gets a 304 and clients may cache for good.
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Attachment file is missing")
+    return FileResponse(
+        path, media_type=media_type, filename=filename, headers=headers,
+        content_disposition_type="inline" if inline else "attachment"
+    )
+
+@router.api_route("/attachments/{attachment_id}", methods=["GET", "HEAD"])
+async def download_chat_attachment(attachment_id: str, request: Request):
+    """Download an attachment. Supports Range and If-None-Match; only images are shown inline."""
+    attachment = await run_in_threadpool(_lookup_attachment, attachment_id)
+    return _file_response(
+        request, attachment_storage.blob_path(attachment.sha256), f'"{attachment.sha256}"',
+        attachment.content_type, filename=attachment.name, inline=attachment.width is not None
+    )
+
+@router.get("/attachments/{attachment_id}/thumbnail")
+async def get_chat_attachment_thumbnail(attachment_id: str, request: Request):
+    """A JPEG thumbnail of an image attachment. Waits briefly if it is still being made."""
+    attachment = await run_in_threadpool(_lookup_attachment, attachment_id)
+    if attachment.width is None:
+        raise HTTPException(status_code=404, detail="Only images have thumbnails")
+    try:
+        path = await attachment_storage.wait_for_thumbnail(attachment.sha256, timeout=5)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Could not make a thumbnail of this image")
+    if path is None:
+        return JSONResponse(status_code=503, content={"detail": "Thumbnail is not ready yet"}, headers={"Retry-After": "1"})
+    return _file_response(request, path, f'"{attachment.sha256}-{attachment_storage.thumbnail_size}"', "image/jpeg")
+
+@router.get("/attachments/{attachment_id}/info")
+async def get_chat_attachment_info(attachment_id: str):
+    """An attachment's name, type, size and (for images) dimensions"""
+    attachment = await run_in_threadpool(_lookup_attachment, attachment_id)
+    return JSONResponse(content={"success": True, "data": chat_store.attachment_to_dict(attachment)})
+
+@router.websocket("/ws/{user_id}")
+async def chat_websocket(websocket: WebSocket, user_id: str):
+    """
+    Real-time events for a user's rooms, as JSON objects with a "type":
+      - "message": a new message ("data" is the message, as returned by /chat/messages)
+      - "read": a room member's read watermark moved
+      - "presence": a room member came online or went offline
+      - "room": the user was added to a new room
+    Send "ping" to get a {"type": "pong"} back; pings also keep the user online. Messages are still sent
+    with POST /chat/send.
+    """
+    def load_room_ids():
+        db = SessionLocal()
+        try:
+            return [room.id for room in chat_store.get_user_rooms(db, user_id)]
+        finally:
+            db.close()
+    
+    room_ids = await run_in_threadpool(load_room_ids)
+    await websocket.accept()
+    connection = chat_hub.connect(websocket, user_id, room_ids)
+    chat_hub.send_to(connection, {"type": "ready", "rooms": room_ids})
+    await run_in_threadpool(presence.heartbeat, user_id)
+    try:
+        while True:
+            if await websocket.receive_text() == "ping":
+                chat_hub.send_to(connection, {"type": "pong"})
+                await run_in_threadpool(presence.heartbeat, user_id)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_hub.disconnect(connection)
+
+@router.get("/metrics")
+def get_chat_metrics():
+    """
+    WebSocket fan-out counters (open connections, events published/delivered, slow clients evicted),
+    presence, the writes of USERS_FILE (`coalesced` counts changes that didn't need a write of their own)
+    and attachment storage
+    """
+    return JSONResponse(content={"success": True, "data": {
+        **chat_hub.metrics(), "presence": presence.metrics(), "users_file": users_store.metrics(),
+        "attachments": attachment_storage.metrics()
+    }})
+
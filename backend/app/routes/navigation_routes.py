@@ -2,133 +2,38 @@
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
-import shutil
+import asyncio
 import os
+import re
 
 # Import the AI logic from our navigation service
-from ..services.navigation_service import find_best_match, precompute_db_embeddings
-
-# Location data and path information
-LOCATION_DATA = {
-    "ace_event_hall": {
-        "human_name": "ACE Event Hall",
-        "description": "A spacious event hall with networking setup and stage area for presentations and gatherings",
-        "image_files": ["ACE_Event_Hall_Networking.jpg", "ACE_Event_Hall_Side_View.jpg", "ACE_Event_Students_Gathering.jpg", "ACE_Hackathon_Stage_Setup.jpg"]
-    },
-    "ace_seminar_hall": {
-        "human_name": "ACE Seminar Hall", 
-        "description": "A professional seminar hall with center aisle seating for academic presentations and lectures",
-        "image_files": ["ACE_Event_Seminar_Hall_Center_Aisle.jpg", "ACE_Event_Seminar_Hall_Wide_Angle.jpg"]
-    },
-    "mpstme_building": {
-        "human_name": "MPSTME Building",
-        "description": "The main MPSTME building with directory signage, elevators, and modern classroom facilities",
-        "image_files": ["MPSTME_Building_Directory_Sign.jpg", "MPSTME_Classroom_Hallway_Signage.jpg", "MPSTME_Elevator_Lobby.jpg", "MPSTME_Entrance_Turnstiles.jpg", "MPSTME_Hallway_Near_Glass_Room.jpg", "MPSTME_Upper_Corridor_View.jpg"]
-    },
-    "nmims_atrium": {
-        "human_name": "NMIMS Atrium Cafeteria",
-        "description": "A modern cafeteria with overhead views, side angles, student crowds, and quiet areas for dining and socializing",
-        "image_files": ["NMIMS_Atrium_Cafeteria_OverheadView.jpg", "NMIMS_Atrium_Cafeteria_SideAngle.jpg", "NMIMS_Atrium_Cafeteria_StudentCrowd.jpg", "NMIMS_Atrium_Cafeteria_WideView.jpg", "NMIMS_Cafeteria_Entrance_Sign.jpg", "NMIMS_Cafeteria_Quiet_Area.jpg", "NMIMS_Cafeteria.jpg"]
-    },
-    "nmims_elevator": {
-        "human_name": "NMIMS Elevator Lobby",
-        "description": "Elevator lobby area with angled views, empty spaces, fire lift access, and student activity",
-        "image_files": ["NMIMS_Elevator_Lobby_Angled_View.jpg", "NMIMS_Elevator_Lobby_Empty.jpg", "NMIMS_Elevator_Lobby_Fire_Lift.jpg", "NMIMS_Elevator_Lobby_WithStudents.jpg"]
-    },
-    "nmims_entrance": {
-        "human_name": "NMIMS Entrance Turnstiles",
-        "description": "Main entrance area with turnstiles for building access control and security",
-        "image_files": ["NMIMS_Entrance_Turnstiles_FrontView.jpg", "NMIMS_Entrance_Turnstiles_SideView.jpg"]
-    },
-    "nmims_classroom": {
-        "human_name": "NMIMS Modern Classroom",
-        "description": "Modern classroom interior with hallway signage and contemporary learning environment",
-        "image_files": ["NMIMS_Hallway_Classroom_Signage.jpg", "NMIMS_Modern_Classroom_Interior.jpg"]
-    }
-}
-
-DUMMY_PATHS = {
-    "ACE Event Hall": {
-        "ACE Seminar Hall": ["Walk towards the main corridor", "Turn left at the intersection", "Continue straight for 50 meters"],
-        "NMIMS Atrium Cafeteria": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "MPSTME Building": ["Exit the building", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Elevator Lobby": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "NMIMS Entrance Turnstiles": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building main entrance"],
-        "NMIMS Modern Classroom": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to upper floors"]
-    },
-    "ACE Seminar Hall": {
-        "ACE Event Hall": ["Walk towards the main corridor", "Turn right at the intersection", "Continue straight for 50 meters"],
-        "NMIMS Atrium Cafeteria": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "MPSTME Building": ["Exit the building", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Elevator Lobby": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "NMIMS Entrance Turnstiles": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building main entrance"],
-        "NMIMS Modern Classroom": ["Exit the building", "Cross the courtyard", "Enter the NMIMS building", "Take elevator to upper floors"]
-    },
-    "NMIMS Atrium Cafeteria": {
-        "ACE Event Hall": ["Take elevator to ground floor", "Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "ACE Seminar Hall": ["Take elevator to ground floor", "Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "MPSTME Building": ["Exit the NMIMS building", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Elevator Lobby": ["Walk towards the main entrance", "Follow signs to elevator lobby"],
-        "NMIMS Entrance Turnstiles": ["Walk towards the main entrance", "Follow signs to entrance turnstiles"],
-        "NMIMS Modern Classroom": ["Take elevator to upper floors", "Follow hallway signs to classroom area"]
-    },
-    "MPSTME Building": {
-        "ACE Event Hall": ["Exit the MPSTME building", "Walk across the campus", "Enter the ACE building"],
-        "ACE Seminar Hall": ["Exit the MPSTME building", "Walk across the campus", "Enter the ACE building"],
-        "NMIMS Atrium Cafeteria": ["Exit the MPSTME building", "Walk across the campus", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "NMIMS Elevator Lobby": ["Exit the MPSTME building", "Walk across the campus", "Enter the NMIMS building", "Take elevator to ground floor"],
-        "NMIMS Entrance Turnstiles": ["Exit the MPSTME building", "Walk across the campus", "Enter the NMIMS building main entrance"],
-        "NMIMS Modern Classroom": ["Exit the MPSTME building", "Walk across the campus", "Enter the NMIMS building", "Take elevator to upper floors"]
-    },
-    "NMIMS Elevator Lobby": {
-        "ACE Event Hall": ["Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "ACE Seminar Hall": ["Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "NMIMS Atrium Cafeteria": ["Take elevator to ground floor", "Follow signs to cafeteria"],
-        "MPSTME Building": ["Exit the NMIMS building", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Entrance Turnstiles": ["Walk towards the main entrance", "Follow signs to entrance turnstiles"],
-        "NMIMS Modern Classroom": ["Take elevator to upper floors", "Follow hallway signs to classroom area"]
-    },
-    "NMIMS Entrance Turnstiles": {
-        "ACE Event Hall": ["Enter the NMIMS building", "Exit through rear entrance", "Cross the courtyard", "Enter the ACE building"],
-        "ACE Seminar Hall": ["Enter the NMIMS building", "Exit through rear entrance", "Cross the courtyard", "Enter the ACE building"],
-        "NMIMS Atrium Cafeteria": ["Enter the building", "Take elevator to ground floor", "Follow signs to cafeteria"],
-        "MPSTME Building": ["Enter the NMIMS building", "Exit through rear entrance", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Elevator Lobby": ["Enter the building", "Follow signs to elevator lobby"],
-        "NMIMS Modern Classroom": ["Enter the building", "Take elevator to upper floors", "Follow hallway signs to classroom area"]
-    },
-    "NMIMS Modern Classroom": {
-        "ACE Event Hall": ["Take elevator to ground floor", "Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "ACE Seminar Hall": ["Take elevator to ground floor", "Exit the NMIMS building", "Cross the courtyard", "Enter the ACE building"],
-        "NMIMS Atrium Cafeteria": ["Take elevator to ground floor", "Follow signs to cafeteria"],
-        "MPSTME Building": ["Take elevator to ground floor", "Exit the NMIMS building", "Walk across the campus", "Enter the MPSTME building main entrance"],
-        "NMIMS Elevator Lobby": ["Take elevator to ground floor", "Follow signs to elevator lobby"],
-        "NMIMS Entrance Turnstiles": ["Take elevator to ground floor", "Walk towards the main entrance", "Follow signs to entrance turnstiles"]
-    }
-}
-
-DESTINATIONS = [
-    "ACE Event Hall", 
-    "ACE Seminar Hall", 
-    "NMIMS Atrium Cafeteria", 
-    "MPSTME Building",
-    "NMIMS Elevator Lobby",
-    "NMIMS Entrance Turnstiles", 
-    "NMIMS Modern Classroom"
-]
+from ..config import NAV_WARM_UP_WAIT_SECONDS, NAV_RETRY_AFTER_SECONDS, NAV_MAX_UPLOAD_BYTES, NAV_PHOTOS_DIR
+from ..services import navigation_service
+from ..services.navigation_batcher import inference_batcher, NavigationBusyError
+from ..services.match_cache import match_cache
+from ..services.route_graph import get_route_engine, RouteNotFoundError
+from ..services import location_catalogue
+from ..schemas.navigation_schemas import Location
 
 router = APIRouter(
     prefix="/navigation",
     tags=["Navigation"]
 )
 
-UPLOAD_DIR = "uploaded_nav_photos"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 # This is a new endpoint to provide the list of destinations to the frontend
 @router.get("/destinations", response_model=list[str])
 async def get_destinations():
     """Returns a list of all possible navigation destinations."""
-    return DESTINATIONS
+    return get_route_engine().destinations()
+
+@router.get("/metrics")
+async def get_navigation_metrics():
+    """Inference queue depth, batch sizes, and queue-wait vs. compute latency for this worker."""
+    return {
+        **inference_batcher.metrics(),
+        "profile": navigation_service.inference_profile,
+        "result_cache": match_cache.metrics(),
+    }
 
 @router.post("/find-path/")
 async def find_path(file: UploadFile = File(...), destination: str = Form(...)):
@@ -136,39 +41,160 @@ async def find_path(file: UploadFile = File(...), destination: str = Form(...)):
     Identifies user's location from an uploaded photo and provides a path
     to the selected destination.
     """
-    temp_path = os.path.join(UPLOAD_DIR, file.filename)
-    try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    # Lazy/background workers may still be loading the models
+    if not await wait_for_navigation_models():
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Navigation is starting up, please retry shortly.", "state": navigation_service.navigation_status["state"]},
+            headers={"Retry-After": str(NAV_RETRY_AFTER_SECONDS)}
+        )
 
-        # Use our AI service to find the best match
-        matched_key, score = find_best_match(temp_path)
+    # The photo is matched straight from memory; nothing is written to disk
+    image_bytes = await file.read(NAV_MAX_UPLOAD_BYTES + 1)
+    if len(image_bytes) > NAV_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Photo is too large (max {NAV_MAX_UPLOAD_BYTES // (1024 * 1024)} MB).")
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Uploaded photo is empty.")
 
-        if not matched_key:
+    # Retries of the same photo (e.g. after picking another destination) reuse the earlier match
+    cache_key = await asyncio.to_thread(match_cache.key_for, image_bytes) if match_cache.enabled else None
+    generation = navigation_service.reference_matrices.generation
+    cached = match_cache.get(cache_key, generation)
+    if cached is not None:
+        matched_key, score = cached
+    else:
+        # Use our AI service to find the best match (batched with any concurrent uploads)
+        try:
+            matched_key, score = await inference_batcher.submit(image_bytes)
+        except NavigationBusyError as e:
             return JSONResponse(
-                status_code=404,
-                content={"error": "Could not confidently identify your location.", "confidence": f"{score:.2f}"}
+                status_code=503,
+                content={"error": str(e)},
+                headers={"Retry-After": str(e.retry_after)}
             )
+        if score is not None:
+            match_cache.put(cache_key, (matched_key, score), generation)
 
-        current_location = LOCATION_DATA[matched_key]["human_name"]
-        path_steps = DUMMY_PATHS.get(current_location, {}).get(destination)
+    if score is None:
+        raise HTTPException(status_code=400, detail="Could not read the uploaded photo. Please upload a JPEG or PNG image.")
 
-        if not path_steps:
-            raise HTTPException(status_code=500, detail="Path data missing for this route.")
+    if not matched_key:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Could not confidently identify your location.", "confidence": f"{score:.2f}"}
+        )
 
-        return JSONResponse(content={
-            "current_location": current_location,
-            "destination": destination,
-            "confidence": f"{score:.2f}",
-            "path": path_steps
-        })
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    # The catalogue may have been edited while this photo was being matched
+    location = location_catalogue.get_catalogue().get(matched_key)
+    if location is None:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Navigation data is being updated, please retry shortly."},
+            headers={"Retry-After": str(NAV_RETRY_AFTER_SECONDS)}
+        )
+    current_location = location["human_name"]
+    try:
+        path_steps, _ = get_route_engine().route(matched_key, destination)
+    except RouteNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return JSONResponse(content={
+        "current_location": current_location,
+        "destination": destination,
+        "confidence": f"{score:.2f}",
+        "path": path_steps
+    })
+
+# ===================================================================
+# --- Admin Endpoints for the Location Catalogue ---
+# ===================================================================
+
+@router.get("/admin/locations")
+def get_locations():
+    return location_catalogue.get_catalogue()
+
+@router.put("/admin/locations/{location_key}")
+def put_location(location_key: str, location: Location):
+    """Adds or updates a location; only that location is re-encoded."""
+    try:
+        summary = location_catalogue.upsert_location(location_key, location.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"location": location_key, "reindex": summary}
+
+@router.delete("/admin/locations/{location_key}")
+def delete_location(location_key: str):
+    try:
+        summary = location_catalogue.remove_location(location_key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return {"location": location_key, "reindex": summary}
+
+@router.post("/admin/locations/{location_key}/photos")
+def add_location_photo(location_key: str, file: UploadFile = File(...)):
+    """Saves a new reference photo for a location and indexes it. Photo names must be unique across locations."""
+    if location_key not in location_catalogue.get_catalogue():
+        raise HTTPException(status_code=404, detail="Location not found")
+    filename = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(file.filename or ""))
+    if not filename.lower().endswith((".jpg", ".jpeg", ".png")):
+        raise HTTPException(status_code=400, detail="Reference photos must be JPEG or PNG files.")
+    image_bytes = file.file.read(NAV_MAX_UPLOAD_BYTES + 1)
+    if not image_bytes or len(image_bytes) > NAV_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="Photo is empty or too large.")
+    try:
+        navigation_service.load_image(image_bytes)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not read the uploaded photo.")
+
+    try:
+        summary = location_catalogue.add_photo(location_key, filename, image_bytes)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Location not found")
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=f"{e} Rename the photo and upload it again.")
+    return {"location": location_key, "photo": filename, "reindex": summary}
+
+@router.post("/admin/reload")
+def reload_locations():
+    """Re-reads the catalogue file and campus map, re-encoding only what changed."""
+    try:
+        summary = location_catalogue.reload_catalogue()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not reload the location catalogue: {e}")
+    return {"locations": len(location_catalogue.get_catalogue()), "reindex": summary}
 
 # We need a small helper function to load the AI models on startup
 def initialize_navigation_models():
     print("Pre-computing multi-modal embeddings for navigation...")
-    # Make sure to point to the correct photos directory
-    precompute_db_embeddings(location_data=LOCATION_DATA, db_folder_path="app/database_photos")
-    print("Navigation models ready.")
\ No newline at end of file
+    # The catalogue is read at indexing time, so edits made while warming up are never lost
+    navigation_service.warm_up(location_data=location_catalogue.get_catalogue, db_folder_path=NAV_PHOTOS_DIR)
+    print("Navigation models ready.")
+
+def initialize_routes():
+    """Loads the campus map and precomputes every route, so the first request doesn't pay for it."""
+    get_route_engine()
+
+def start_catalogue_watcher():
+    location_catalogue.catalogue_watcher.start()
+
+def stop_catalogue_watcher():
+    location_catalogue.catalogue_watcher.stop()
+
+def start_navigation_warm_up():
+    """Same as initialize_navigation_models(), but on a background thread."""
+    navigation_service.start_background_warm_up(location_data=location_catalogue.get_catalogue, db_folder_path=NAV_PHOTOS_DIR)
+
+async def wait_for_navigation_models(timeout=NAV_WARM_UP_WAIT_SECONDS):
+    """Starts warming up if nobody has yet, then polls (without blocking the event loop) until ready."""
+    if navigation_service.is_ready():
+        return True
+    start_navigation_warm_up()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if navigation_service.is_ready():
+            return True
+        if navigation_service.navigation_status["state"] == "failed":
+            return False
+        await asyncio.sleep(0.25)
+    return navigation_service.is_ready()
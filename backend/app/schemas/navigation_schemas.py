@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import List
+
+class Location(BaseModel):
+    human_name: str
+    description: str
+    image_files: List[str] = []
@@ -0,0 +1,161 @@
+"""
+Multi-process server with shared navigation models.
+
+`uvicorn --workers N` starts N independent processes, and each one loads its own copy of the CLIP
+models and reference embeddings. This runner loads them once in a parent process and then forks the
+workers. The model weights and the reference index are plain tensor/array buffers that inference only
+reads, so the workers share those pages copy-on-write. Memory grows by the small per-worker Python and
+request state instead of by a full model copy.
+
+Usage (from the backend directory):
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+Notes:
+  - The parent loads and indexes with a single torch thread: OpenMP thread pools don't survive fork(),
+    and a worker forked after the parent ran multi-threaded ops can hang. Each worker then gets its own
+    thread count (NAV_TORCH_THREADS, or the CPU count divided by the number of workers). Thanks to the
+    embedding cache, indexing in the parent is only slow on the very first start.
+  - A worker that dies is forked again from the parent, so it comes back warm within milliseconds.
+  - Catalogue edits reach every worker through the catalogue watcher, which this runner turns on (every
+    5s unless NAV_CATALOGUE_WATCH_SECONDS says otherwise). Workers that re-index stop sharing the
+    reference index (the models stay shared).
+  - Linux/macOS only (fork).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def _bind(host, port, backlog=2048):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock, threads, log_level):
+    """Runs in the forked child: fresh signal handlers, its own DB connections and thread count, then uvicorn."""
+    import torch
+    import uvicorn
+    from .database import engine
+    from .main import app, NAVIGATION_ENABLED
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Pooled SQLite connections opened by the parent must not be shared with the children
+    engine.dispose(close=False)
+    torch.set_num_threads(threads)
+    if NAVIGATION_ENABLED:
+        from .services import navigation_service
+        navigation_service.inference_profile["threads"] = threads
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from several workers that share the navigation models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Must happen before the app (and its config) is imported
+    worker_threads = int(os.getenv("NAV_TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // args.workers)
+    os.environ["NAV_TORCH_THREADS"] = "1"
+    os.environ.setdefault("NAV_CATALOGUE_WATCH_SECONDS", "5")
+
+    from .config import NAVIGATION_MODE
+    from . import main as app_main
+
+    # --- Load everything that the workers will share ---
+    app_main.seed_database()
+    app_main.chat_routes.initialize_chat_data()
+    if app_main.NAVIGATION_ENABLED:
+        app_main.navigation_routes.initialize_routes()
+        if NAVIGATION_MODE == "lazy":
+            print("Warning: NAVIGATION_MODE=lazy loads the models in every worker separately; use eager or background to share them.")
+        else:
+            print("Loading navigation models once for all workers...")
+            app_main.navigation_routes.initialize_navigation_models()
+    # Objects that exist now are never collected by the workers, so the garbage collector doesn't write
+    # to (and un-share) their pages
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers ({worker_threads} torch threads each).")
+
+    workers = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(sock, worker_threads, args.log_level)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} crashed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(args.workers):
+        spawn()
+
+    # --- Supervise: replace workers that exit, until asked to stop ---
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            started = workers.pop(pid)
+            print(f"Worker {pid} exited (status {status}); starting a new one.")
+            # Don't spin if workers die right after starting
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            if not stopping:
+                spawn()
+            continue
+        time.sleep(0.5)
+
+    print("Stopping workers...")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + 30
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        os.kill(pid, signal.SIGKILL)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from ..config import (
+    CHAT_ATTACHMENTS_DIR, CHAT_ATTACHMENT_MAX_BYTES, CHAT_THUMBNAIL_SIZE, CHAT_THUMBNAIL_WORKERS,
+    CHAT_THUMBNAIL_MAX_PIXELS,
+)
+
+# Chat attachment files. Every file is stored once per content, as blobs/<sha256[:2]>/<sha256> under the
+# storage directory, so uploading the same bytes again (a forwarded photo, say) stores nothing new.
+# Thumbnails of images are stored the same way under thumbnails/ and made on a thread pool after the
+# upload has been answered. Files are written under a temporary name and renamed into place, so a stored
+# path is always complete.
+
+
+class UploadError(ValueError):
+    """The request isn't an acceptable upload; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _FilePart:
+    """Follows the multipart parser through the request and hashes and collects the bytes of one file field."""
+
+    def __init__(self, field, max_bytes):
+        self.field = field.encode()
+        self.max_bytes = max_bytes
+        self.found = False
+        self.name = None
+        self.content_type = None
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.chunks = []  # Received but not yet written to disk
+        self._active = False
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.found or options.get(b"name") != self.field or b"filename" not in options:
+            return  # Other form fields are ignored
+        self.found = self._active = True
+        self.name = clean_filename(options[b"filename"].decode("utf-8", "replace"))
+        self.content_type = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1").strip()
+
+    def _on_part_data(self, data, start, end):
+        if not self._active:
+            return
+        chunk = bytes(data[start:end])
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadError(f"File is too large (max {self.max_bytes // (1024 * 1024)} MB).", 413)
+        self.hasher.update(chunk)
+        self.chunks.append(chunk)
+
+    def _on_part_end(self):
+        self._active = False
+
+
+def clean_filename(name):
+    """The file name without any directory part (from either kind of slash), for Content-Disposition."""
+    name = name.replace("\\", "/").rsplit("/", 1)[-1].strip().replace("\x00", "")
+    return name[:255] or "file"
+
+
+class AttachmentStorage:
+    def __init__(self, root=CHAT_ATTACHMENTS_DIR, thumbnail_size=CHAT_THUMBNAIL_SIZE,
+                 workers=CHAT_THUMBNAIL_WORKERS, max_pixels=CHAT_THUMBNAIL_MAX_PIXELS):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.workers = max(1, workers)
+        self.max_pixels = max_pixels
+        self._executor = None
+        self._pending = {}  # sha256 -> Future of a thumbnail being made
+        self._lock = threading.Lock()
+        self._stats = {
+            "uploads": 0, "deduplicated": 0, "bytes_stored": 0, "thumbnails": 0, "thumbnail_failures": 0,
+        }
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def thumbnail_path(self, sha256):
+        return os.path.join(self.root, "thumbnails", sha256[:2], f"{sha256}.jpg")
+
+    # --- Upload ---
+    async def receive(self, request, field="file", max_bytes=CHAT_ATTACHMENT_MAX_BYTES):
+        """
+        Streams the file field `field` of a multipart/form-data request to disk, hashing it on the way, and
+        stores it under its hash. Only one network chunk is held in memory at a time, and an upload is cut
+        off as soon as it passes `max_bytes`. Returns a dict with the file's sha256, size, name and
+        content_type, its width and height if it is an image (None otherwise), and whether the same bytes
+        were stored already.
+        """
+        media_type, options = parse_options_header(request.headers.get("content-type"))
+        if media_type != b"multipart/form-data" or not options.get(b"boundary"):
+            raise UploadError("Upload the file as multipart/form-data.", 415)
+        part = _FilePart(field, max_bytes)
+        parser = multipart.MultipartParser(options[b"boundary"], part.callbacks())
+        temp_file, temp_path = await run_in_threadpool(self._open_temp)
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if part.chunks:
+                    data = b"".join(part.chunks)
+                    part.chunks.clear()
+                    await run_in_threadpool(temp_file.write, data)
+            parser.finalize()
+            if not part.found:
+                raise UploadError(f"No file was uploaded (expected a '{field}' field).")
+            if part.size == 0:
+                raise UploadError("Uploaded file is empty.")
+            return await run_in_threadpool(self._store, temp_file, temp_path, part)
+        finally:
+            await run_in_threadpool(self._discard, temp_file, temp_path)
+
+    def _open_temp(self):
+        directory = os.path.join(self.root, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".upload")
+        return os.fdopen(fd, "wb"), path
+
+    @staticmethod
+    def _discard(temp_file, temp_path):
+        temp_file.close()
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass  # Stored
+
+    def _store(self, temp_file, temp_path, part):
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+        temp_file.close()
+        sha256 = part.hasher.hexdigest()
+        path = self.blob_path(sha256)
+        deduplicated = os.path.exists(path)
+        if not deduplicated:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        with self._lock:
+            self._stats["uploads"] += 1
+            if deduplicated:
+                self._stats["deduplicated"] += 1
+            else:
+                self._stats["bytes_stored"] += part.size
+
+        # Only the header is read; the content type of images comes from their actual format
+        width = height = None
+        content_type = part.content_type
+        try:
+            with Image.open(path) as image:
+                width, height = image.size
+                content_type = Image.MIME.get(image.format, content_type)
+        except Exception:
+            if content_type.startswith("image/"):
+                content_type = "application/octet-stream"
+        return {
+            "sha256": sha256, "size": part.size, "name": part.name, "content_type": content_type,
+            "width": width, "height": height, "deduplicated": deduplicated,
+        }
+
+    # --- Thumbnails ---
+    def request_thumbnail(self, sha256):
+        """
+        Queues a thumbnail of a stored image unless it exists or is already being made. Returns the Future of
+        the job, or None if the thumbnail exists.
+        """
+        if os.path.exists(self.thumbnail_path(sha256)):
+            return None
+        with self._lock:
+            future = self._pending.get(sha256)
+            if future is not None:
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chat-thumbnail")
+            future = self._executor.submit(self._make_thumbnail, sha256)
+            self._pending[sha256] = future
+        # Outside the lock: a job that has already finished runs the callback right here
+        future.add_done_callback(lambda done: self._thumbnail_done(sha256, done))
+        return future
+
+    async def wait_for_thumbnail(self, sha256, timeout):
+        """
+        The thumbnail's path once it exists (making it if needed), or None if it isn't ready within `timeout`
+        seconds. Raises the job's error if the image can't be thumbnailed.
+        """
+        future = self.request_thumbnail(sha256)
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.thumbnail_path(sha256)
+
+    def _make_thumbnail(self, sha256):
+        size = self.thumbnail_size
+        with Image.open(self.blob_path(sha256)) as image:
+            if image.width * image.height > self.max_pixels:
+                raise ValueError(f"Image is too large ({image.width}x{image.height} pixels).")
+            # JPEGs are downscaled while decoding, so big photos are never fully decoded
+            image.draft("RGB", (size, size))
+            thumbnail = ImageOps.exif_transpose(image)
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+        if thumbnail.mode in ("RGBA", "LA") or (thumbnail.mode == "P" and "transparency" in thumbnail.info):
+            thumbnail = thumbnail.convert("RGBA")
+            background = Image.new("RGB", thumbnail.size, (255, 255, 255))
+            background.paste(thumbnail, mask=thumbnail.getchannel("A"))
+            thumbnail = background
+        else:
+            thumbnail = thumbnail.convert("RGB")
+        path = self.thumbnail_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        thumbnail.save(temp_path, "JPEG", quality=80, optimize=True)
+        os.replace(temp_path, path)
+
+    def _thumbnail_done(self, sha256, future):
+        with self._lock:
+            self._pending.pop(sha256, None)
+            if future.cancelled():
+                return
+            if future.exception() is None:
+                self._stats["thumbnails"] += 1
+                return
+            self._stats["thumbnail_failures"] += 1
+        print(f"Warning: Could not make a thumbnail of attachment {sha256}: {future.exception()}")
+
+    def shutdown(self):
+        """Stops the thumbnail workers; queued thumbnails are made again when they are first requested."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def metrics(self):
+        with self._lock:
+            return {**self._stats, "thumbnails_pending": len(self._pending)}
+
+
+attachment_storage = AttachmentStorage()
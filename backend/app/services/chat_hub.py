@@ -0,0 +1,220 @@
+import asyncio
+import json
+
+from ..config import CHAT_WS_QUEUE_SIZE, CHAT_WS_SEND_TIMEOUT_SECONDS, CHAT_BROKER
+
+# Real-time chat delivery. Every WebSocket connection subscribes to the rooms its user takes part in.
+# Events (new messages, read receipts, presence changes, new rooms) are published per room through a
+# broker and fanned out to the subscribed connections, each of which has its own bounded send queue.
+# All connection bookkeeping happens on the event loop; publish() may be called from any thread, such as
+# the sync chat routes.
+
+
+class InMemoryBroker:
+    """
+    Hands every published event straight back to the subscribers in this process. A broker shared by
+    several server workers (Redis pub/sub, NATS, ...) can replace it through set_broker(); it needs the
+    same methods, and may call the subscribed handlers from any thread.
+    """
+
+    def __init__(self):
+        self._handlers = []
+
+    def subscribe(self, handler):
+        """`handler(room_ids, payload)` is called for every published event, with the rooms it was sent to."""
+        self._handlers.append(handler)
+
+    def publish(self, room_ids, payload):
+        """Sends one event to several rooms; it must reach the handlers as one event, not one per room."""
+        for handler in list(self._handlers):
+            handler(room_ids, payload)
+
+    def close(self):
+        self._handlers.clear()
+
+
+BROKERS = {"memory": InMemoryBroker}
+
+
+class ChatConnection:
+    def __init__(self, websocket, user_id, queue_size):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.rooms = set()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.sender = None
+
+
+class ChatHub:
+    """
+    Fans chat events out to WebSocket connections, by room.
+
+    A connection that can't keep up (its queue of `queue_size` events is full, or one send takes longer
+    than `send_timeout` seconds) is closed rather than allowed to hold up everyone else or to buffer
+    without bound; the client reconnects and catches up over /chat/messages.
+    """
+
+    def __init__(self, broker=None, queue_size=CHAT_WS_QUEUE_SIZE, send_timeout=CHAT_WS_SEND_TIMEOUT_SECONDS):
+        self.queue_size = max(1, queue_size)
+        self.send_timeout = send_timeout
+        self._rooms = {}  # room_id -> set of ChatConnection
+        self._users = {}  # user_id -> set of ChatConnection
+        self._loop = None
+        self._broker = None
+        self._stats = {"published": 0, "delivered": 0, "evicted": 0, "connections_opened": 0}
+        self.set_broker(broker or InMemoryBroker())
+
+    def set_broker(self, broker):
+        if self._broker is not None:
+            self._broker.close()
+        self._broker = broker
+        broker.subscribe(self._receive)
+
+    # --- Publishing (any thread) ---
+    def publish(self, room_id, event):
+        """Sends `event` (a JSON-serializable dict) to everyone connected to `room_id`."""
+        self.publish_to_rooms([room_id], event)
+
+    def publish_to_rooms(self, room_ids, event):
+        """Sends `event` once to every connection in any of `room_ids` (a user in two of them gets it once)."""
+        room_ids = list(room_ids)
+        if not room_ids:
+            return
+        payload = json.dumps(event)  # Serialized once, however many connections receive it
+        self._stats["published"] += 1
+        self._broker.publish(room_ids, payload)
+
+    def add_room_members(self, room_id, user_ids):
+        """Subscribes the open connections of `user_ids` to a new room."""
+        self._call_on_loop(self._add_room_members, room_id, list(user_ids))
+
+    def _receive(self, room_ids, payload):
+        self._call_on_loop(self._deliver, room_ids, payload)
+
+    def _call_on_loop(self, callback, *args):
+        # Nobody is connected until the first WebSocket sets the loop, so there's nothing to deliver
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            callback(*args)
+        else:
+            loop.call_soon_threadsafe(callback, *args)
+
+    # --- Delivery (event loop) ---
+    def _deliver(self, room_ids, payload):
+        connections = set()
+        for room_id in room_ids:
+            connections.update(self._rooms.get(room_id, ()))
+        for connection in connections:
+            self._enqueue(connection, payload)
+
+    def _enqueue(self, connection, payload):
+        if connection.closed:
+            return
+        try:
+            connection.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            print(f"Chat connection of user {connection.user_id} is too slow; disconnecting it.")
+            self._evict(connection)
+
+    def _add_room_members(self, room_id, user_ids):
+        for user_id in user_ids:
+            for connection in self._users.get(user_id, ()):
+                connection.rooms.add(room_id)
+                self._rooms.setdefault(room_id, set()).add(connection)
+
+    async def _send_loop(self, connection):
+        try:
+            while True:
+                payload = await connection.queue.get()
+                await asyncio.wait_for(connection.websocket.send_text(payload), self.send_timeout)
+                self._stats["delivered"] += 1
+        except asyncio.TimeoutError:
+            print(f"Chat connection of user {connection.user_id} stopped reading; disconnecting it.")
+            self._evict(connection)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The client went away; the receive loop in the route cleans up
+            self.disconnect(connection)
+
+    # --- Connections (event loop) ---
+    def connect(self, websocket, user_id, room_ids):
+        """Registers an accepted WebSocket and starts its sender task."""
+        self._loop = asyncio.get_running_loop()
+        connection = ChatConnection(websocket, user_id, self.queue_size)
+        self._users.setdefault(user_id, set()).add(connection)
+        for room_id in room_ids:
+            connection.rooms.add(room_id)
+            self._rooms.setdefault(room_id, set()).add(connection)
+        connection.sender = self._loop.create_task(self._send_loop(connection))
+        self._stats["connections_opened"] += 1
+        return connection
+
+    def send_to(self, connection, event):
+        """Queues an event for a single connection (e.g. a reply to a ping)."""
+        self._enqueue(connection, json.dumps(event))
+
+    def disconnect(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        for room_id in connection.rooms:
+            members = self._rooms.get(room_id)
+            if members is not None:
+                members.discard(connection)
+                if not members:
+                    del self._rooms[room_id]
+        user_connections = self._users.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self._users[connection.user_id]
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+
+    def _evict(self, connection):
+        if connection.closed:
+            return
+        self._stats["evicted"] += 1
+        self.disconnect(connection)
+        # 1013 "try again later": the client should reconnect and resync
+        asyncio.get_running_loop().create_task(self._close(connection.websocket, 1013))
+
+    @staticmethod
+    async def _close(websocket, code):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def close(self):
+        """Closes every connection (on shutdown)."""
+        connections = [c for members in self._users.values() for c in members]
+        for connection in connections:
+            self.disconnect(connection)
+            await self._close(connection.websocket, 1001)
+
+    def metrics(self):
+        return {
+            **self._stats,
+            "connections": sum(len(members) for members in self._users.values()),
+            "users": len(self._users),
+            "rooms": len(self._rooms),
+            "queued": sum(c.queue.qsize() for members in self._users.values() for c in members),
+        }
+
+
+def create_broker(name=CHAT_BROKER):
+    if name not in BROKERS:
+        raise ValueError(f"Unknown CHAT_BROKER '{name}'. Expected one of: {', '.join(BROKERS)}.")
+    return BROKERS[name]()
+
+
+chat_hub = ChatHub(create_broker())
@@ -0,0 +1,540 @@
+import html
+import math
+import re
+import unicodedata
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import func, inspect, literal_column, select, text, tuple_, update
+
+from ..config import CHAT_SEARCH_CANDIDATES, CHAT_SEARCH_IDF_WINDOW
+from ..models import chat_models as models
+
+# Chat rooms and messages live in SQLite (see models/chat_models.py). A send is one INSERT and a read
+# receipt one UPDATE, each in its own transaction, so the cost doesn't depend on the size of the history
+# and concurrent requests (or server workers) don't overwrite each other's changes. Every room also keeps
+# a pointer to its last message and every participant a read watermark and an unread counter; they are
+# updated in the same transaction as the send or read that changes them, so listing a user's rooms costs
+# O(their rooms).
+
+
+def message_to_dict(message, read_up_to=0):
+    """
+    The API representation of a message (the same shape the JSON store used). `isRead` is relative to a
+    read watermark: true if the message's seq is at or below `read_up_to`.
+    """
+    return {
+        "id": message.id,
+        "roomId": message.room_id,
+        "senderId": message.sender_id,
+        "senderName": message.sender_name,
+        "senderAvatar": message.sender_avatar,
+        "content": message.content,
+        "timestamp": message.timestamp,
+        "isRead": message.seq <= read_up_to,
+        "messageType": message.message_type,
+        "attachment": attachment_reference(message.attachment_id, message.message_type == "image"),
+    }
+
+
+def attachment_reference(attachment_id, is_image):
+    """What a message carries of its attachment: where to fetch it (details are at /chat/attachments/{id}/info)."""
+    if not attachment_id:
+        return None
+    url = f"/chat/attachments/{attachment_id}"
+    return {"id": attachment_id, "url": url, "thumbnailUrl": f"{url}/thumbnail" if is_image else None}
+
+
+def get_user_rooms(db, user_id):
+    """Rooms the user takes part in, in the order they were added (SQLite's rowid)."""
+    return (
+        db.query(models.ChatRoom)
+        .join(models.ChatParticipant, models.ChatParticipant.room_id == models.ChatRoom.id)
+        .filter(models.ChatParticipant.user_id == user_id)
+        .order_by(literal_column("chat_rooms.rowid"))
+        .all()
+    )
+
+
+def get_room_summaries(db, user_id):
+    """
+    The user's rooms as (room, last message or None, the user's ChatParticipant row, participant ids),
+    with two queries however long the rooms' histories are.
+    """
+    rows = (
+        db.query(models.ChatRoom, models.ChatMessage, models.ChatParticipant)
+        .join(models.ChatParticipant, models.ChatParticipant.room_id == models.ChatRoom.id)
+        .outerjoin(models.ChatMessage, models.ChatMessage.seq == models.ChatRoom.last_message_seq)
+        .filter(models.ChatParticipant.user_id == user_id)
+        .order_by(literal_column("chat_rooms.rowid"))
+        .all()
+    )
+    participants = {}
+    if rows:
+        members = (
+            db.query(models.ChatParticipant.room_id, models.ChatParticipant.user_id)
+            .filter(models.ChatParticipant.room_id.in_([room.id for room, _, _ in rows]))
+            .order_by(models.ChatParticipant.room_id, models.ChatParticipant.position)
+            .all()
+        )
+        for room_id, member_id in members:
+            participants.setdefault(room_id, []).append(member_id)
+    return [(room, last, member, participants.get(room.id, [])) for room, last, member in rows]
+
+
+def get_participant(db, room_id, user_id):
+    return (
+        db.query(models.ChatParticipant)
+        .filter(models.ChatParticipant.room_id == room_id, models.ChatParticipant.user_id == user_id)
+        .first()
+    )
+
+
+def read_by_everyone_up_to(db, room_id):
+    """The lowest read watermark in the room: every participant has read the messages up to it."""
+    return (
+        db.query(func.min(models.ChatParticipant.last_read_seq))
+        .filter(models.ChatParticipant.room_id == room_id)
+        .scalar()
+    ) or 0
+
+
+def get_message(db, message_id):
+    return db.query(models.ChatMessage).filter(models.ChatMessage.id == message_id).first()
+
+
+def get_messages_page(db, room_id, limit, before=None, after=None):
+    """
+    One page of a room's history, oldest first, using keyset pagination on (timestamp, seq).
+    `before`/`after` are messages (usually looked up from a cursor id): the page holds the `limit` messages
+    just before `before`, just after `after`, or the newest ones if neither is given. Returns
+    (messages, has_more), where has_more says whether more messages exist in the direction of travel.
+    """
+    query = db.query(models.ChatMessage).filter(models.ChatMessage.room_id == room_id)
+    position = tuple_(models.ChatMessage.timestamp, models.ChatMessage.seq)
+    if after is not None:
+        query = query.filter(position > tuple_(after.timestamp, after.seq))
+        order = (models.ChatMessage.timestamp, models.ChatMessage.seq)
+    else:
+        if before is not None:
+            query = query.filter(position < tuple_(before.timestamp, before.seq))
+        order = (models.ChatMessage.timestamp.desc(), models.ChatMessage.seq.desc())
+    # One extra row tells whether there is another page
+    messages = query.order_by(*order).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+    return messages, has_more
+
+
+def room_exists(db, room_id):
+    return db.query(models.ChatRoom.id).filter(models.ChatRoom.id == room_id).first() is not None
+
+
+def add_message(db, room_id, sender, content, message_type="text", attachment_id=None):
+    message = models.ChatMessage(
+        id=str(uuid.uuid4()),
+        room_id=room_id,
+        sender_id=sender["id"],
+        sender_name=sender["name"],
+        sender_avatar=sender.get("avatar"),
+        content=content,
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        is_read=False,
+        message_type=message_type,
+        attachment_id=attachment_id,
+    )
+    db.add(message)
+    db.flush()  # Assigns message.seq
+    db.execute(
+        update(models.ChatRoom)
+        .where(models.ChatRoom.id == room_id)
+        .values(last_message_seq=message.seq)
+    )
+    # One more unread message for everyone else (incremented in SQL, so concurrent sends can't lose
+    # updates); the sender has read the room up to their own message
+    db.execute(
+        update(models.ChatParticipant)
+        .where(models.ChatParticipant.room_id == room_id, models.ChatParticipant.user_id != message.sender_id)
+        .values(unread_count=models.ChatParticipant.unread_count + 1)
+    )
+    db.execute(
+        update(models.ChatParticipant)
+        .where(models.ChatParticipant.room_id == room_id, models.ChatParticipant.user_id == message.sender_id)
+        .values(last_read_seq=message.seq, unread_count=0)
+    )
+    db.commit()
+    return message
+
+
+def mark_room_read(db, room_id, user_id, up_to=None):
+    """
+    Moves the user's read watermark in a room forward to the message `up_to` (by default the room's last
+    message) and recounts their unread messages after it. A single UPDATE, however many messages that
+    marks read; the watermark never moves backwards. Returns the participant row, or None if the user
+    isn't in the room.
+    """
+    if up_to is None:
+        up_to = (
+            db.query(models.ChatMessage)
+            .join(models.ChatRoom, models.ChatRoom.last_message_seq == models.ChatMessage.seq)
+            .filter(models.ChatRoom.id == room_id)
+            .first()
+        )
+    if up_to is not None:
+        # Unread means after the watermark in seq order, the same order send and rebuild use
+        unread = (
+            select(func.count(models.ChatMessage.seq))
+            .where(
+                models.ChatMessage.room_id == room_id,
+                models.ChatMessage.seq > up_to.seq,
+                models.ChatMessage.sender_id != user_id,
+            )
+            .scalar_subquery()
+        )
+        db.execute(
+            update(models.ChatParticipant)
+            .where(
+                models.ChatParticipant.room_id == room_id,
+                models.ChatParticipant.user_id == user_id,
+                models.ChatParticipant.last_read_seq < up_to.seq,
+            )
+            .values(last_read_seq=up_to.seq, unread_count=unread)
+        )
+        db.commit()
+    return get_participant(db, room_id, user_id)
+
+
+def create_room(db, name, room_type, participant_ids, room_id=None, created_at=None):
+    room = models.ChatRoom(
+        id=room_id or str(uuid.uuid4()),
+        name=name,
+        type=room_type,
+        created_at=created_at or datetime.now(timezone.utc).isoformat(),
+    )
+    db.add(room)
+    # A participant listed twice is only added once
+    for position, user_id in enumerate(dict.fromkeys(participant_ids)):
+        db.add(models.ChatParticipant(room_id=room.id, user_id=user_id, position=position))
+    return room
+
+
+def room_to_dict(room, participant_ids):
+    return {
+        "id": room.id,
+        "name": room.name,
+        "type": room.type,
+        "participants": participant_ids,
+        "unreadCount": 0,
+        "createdAt": room.created_at,
+    }
+
+
+# --- Attachments ---
+def add_attachment(db, upload, uploader_id):
+    """Records an upload stored by services/chat_attachments.py (its receive() result)."""
+    attachment = models.ChatAttachment(
+        id=str(uuid.uuid4()),
+        sha256=upload["sha256"],
+        name=upload["name"],
+        content_type=upload["content_type"],
+        size=upload["size"],
+        uploader_id=uploader_id,
+        created_at=datetime.now(timezone.utc).isoformat(),
+        width=upload["width"],
+        height=upload["height"],
+    )
+    db.add(attachment)
+    db.commit()
+    return attachment
+
+
+def get_attachment(db, attachment_id):
+    return db.query(models.ChatAttachment).filter(models.ChatAttachment.id == attachment_id).first()
+
+
+def attachment_to_dict(attachment):
+    return {
+        **attachment_reference(attachment.id, attachment.width is not None),
+        "name": attachment.name,
+        "contentType": attachment.content_type,
+        "size": attachment.size,
+        "width": attachment.width,
+        "height": attachment.height,
+        "createdAt": attachment.created_at,
+    }
+
+
+# --- Import from the JSON files ---
+def import_json_data(db, chat_data, messages_data):
+    """
+    Copies rooms and messages from the old JSON files into empty chat tables, so existing chat history
+    carries over. Tables that already have rows are left alone.
+    """
+    imported = {"rooms": 0, "messages": 0}
+    if db.query(models.ChatRoom.id).first() is None:
+        for room in chat_data.get("rooms", []):
+            create_room(db, room["name"], room.get("type", "group"), room.get("participants", []),
+                        room_id=room["id"], created_at=room.get("createdAt"))
+            imported["rooms"] += 1
+        db.flush()
+    if db.query(models.ChatMessage.seq).first() is None:
+        # Inserted in timestamp order, so `seq` follows the conversation order
+        for message in sorted(messages_data.get("messages", []), key=lambda m: m["timestamp"]):
+            db.add(models.ChatMessage(
+                id=message["id"],
+                room_id=message["roomId"],
+                sender_id=message["senderId"],
+                sender_name=message.get("senderName"),
+                sender_avatar=message.get("senderAvatar"),
+                content=message["content"],
+                timestamp=message["timestamp"],
+                is_read=message.get("isRead", False),
+                message_type=message.get("messageType", "text"),
+            ))
+            imported["messages"] += 1
+    if imported["rooms"] or imported["messages"]:
+        db.flush()
+        rebuild_room_summaries(db, watermarks_from_read_flags=True)
+    db.commit()
+    return imported
+
+
+def rebuild_room_summaries(db, watermarks_from_read_flags=False):
+    """
+    Recomputes every room's last message pointer and every participant's unread count from the messages.
+    With `watermarks_from_read_flags`, the read watermarks are first derived from the messages' is_read
+    flags (as imported from the JSON store): everything before a participant's first unread message
+    counts as read.
+    """
+    db.execute(update(models.ChatRoom).values(last_message_seq=(
+        select(func.max(models.ChatMessage.seq))
+        .where(models.ChatMessage.room_id == models.ChatRoom.id)
+        .scalar_subquery()
+    )))
+    if watermarks_from_read_flags:
+        first_unread = (
+            select(func.min(models.ChatMessage.seq))
+            .where(
+                models.ChatMessage.room_id == models.ChatParticipant.room_id,
+                models.ChatMessage.is_read == False,
+                models.ChatMessage.sender_id != models.ChatParticipant.user_id,
+            )
+            .scalar_subquery()
+        )
+        last_message = (
+            select(func.max(models.ChatMessage.seq))
+            .where(models.ChatMessage.room_id == models.ChatParticipant.room_id)
+            .scalar_subquery()
+        )
+        db.execute(update(models.ChatParticipant).values(
+            last_read_seq=func.coalesce(first_unread - 1, last_message, 0)
+        ))
+    db.execute(update(models.ChatParticipant).values(unread_count=(
+        select(func.count(models.ChatMessage.seq))
+        .where(
+            models.ChatMessage.room_id == models.ChatParticipant.room_id,
+            models.ChatMessage.seq > models.ChatParticipant.last_read_seq,
+            models.ChatMessage.sender_id != models.ChatParticipant.user_id,
+        )
+        .scalar_subquery()
+    )))
+
+
+# --- Schema upgrades ---
+def upgrade_schema(engine):
+    """
+    Brings chat tables created by an earlier version up to date: create_all() only creates missing tables,
+    so missing columns and indexes are added here. Returns the added columns as "table.column" names; if
+    any were added, the room summaries need a rebuild_room_summaries().
+    """
+    added = set()
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            if not table.name.startswith("chat_"):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(engine.dialect)
+                default = f" NOT NULL DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+                added.add(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+    return added
+
+
+# --- Full-text search ---
+# Message text is indexed in an FTS5 table that reads its content from chat_messages (so the text isn't
+# stored twice). Triggers keep it in sync, so a send indexes its message in the same transaction. The room
+# is indexed too, as one hex token per room id, so a search only ever visits messages from the rooms it is
+# scoped to instead of filtering matches from every room afterwards.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        content, room_id,
+        content='chat_messages', content_rowid='seq', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, content, room_id) VALUES (new.seq, new.content, hex(new.room_id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content, room_id)
+        VALUES ('delete', old.seq, old.content, hex(old.room_id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content, room_id ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content, room_id)
+        VALUES ('delete', old.seq, old.content, hex(old.room_id));
+        INSERT INTO chat_messages_fts(rowid, content, room_id) VALUES (new.seq, new.content, hex(new.room_id));
+    END""",
+]
+MAX_SEARCH_TERMS = 16
+
+
+def create_search_index(engine):
+    """Creates the search index and its triggers; indexes existing messages if the index is new."""
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages_fts'")
+        ).first()
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            # Not the 'rebuild' command: that would index the raw room ids instead of their hex tokens
+            connection.execute(text(
+                "INSERT INTO chat_messages_fts(rowid, content, room_id) "
+                "SELECT seq, content, hex(room_id) FROM chat_messages"
+            ))
+
+
+def _fold(value):
+    """Lowercases and strips accents, like the index's tokenizer (unicode61 remove_diacritics 2)."""
+    value = value.lower()
+    if value.isascii():
+        return value
+    value = unicodedata.normalize("NFKD", value)
+    return "".join(ch for ch in value if not unicodedata.combining(ch))
+
+
+def parse_search_query(query):
+    """
+    Splits what a user typed into words: every word must match, and the last one may be unfinished (a
+    prefix) unless the query ends with a space. Operators and quotes are treated as plain text. Returns
+    (words, last_word_is_prefix).
+    """
+    words = [_fold(word) for word in re.findall(r"\w+", query)[:MAX_SEARCH_TERMS]]
+    return words, bool(words) and not query[-1:].isspace()
+
+
+def _phrase(word, prefix):
+    return f'"{word}"*' if prefix else f'"{word}"'
+
+
+def search_expression(words, prefix, room_ids=None):
+    """The FTS5 query matching messages that contain every word, optionally limited to `room_ids`."""
+    terms = [_phrase(word, prefix and i == len(words) - 1) for i, word in enumerate(words)]
+    expression = f"content : ({' '.join(terms)})"
+    if room_ids:
+        rooms = " OR ".join(f'"{room_id.encode().hex().upper()}"' for room_id in room_ids)
+        expression += f" AND room_id : ({rooms})"
+    return expression
+
+
+def _document_frequencies(db, words, prefix, window):
+    """
+    How many of the newest `window` messages contain each word, and how many messages that window holds.
+    FTS5's own bm25() counts every message containing a word to get its IDF, which costs tens of
+    milliseconds for very common words in a large history; a recent sample is cheap and close enough.
+    """
+    newest = db.execute(text("SELECT max(seq) FROM chat_messages")).scalar() or 0
+    floor = max(0, newest - window)
+    total = db.execute(text("SELECT count(*) FROM chat_messages WHERE seq > :floor"), {"floor": floor}).scalar()
+    frequencies = {}
+    for i, word in enumerate(words):
+        expression = f"content : {_phrase(word, prefix and i == len(words) - 1)}"
+        frequencies[word] = db.execute(
+            text("SELECT count(*) FROM chat_messages_fts WHERE chat_messages_fts MATCH :expression AND rowid > :floor"),
+            {"expression": expression, "floor": floor},
+        ).scalar()
+    return frequencies, total
+
+
+def _matches(token, words, prefix):
+    return token in words[:-1] or (token.startswith(words[-1]) if prefix else token == words[-1])
+
+
+def _snippet(content, words, prefix, size):
+    """Up to `size` words of `content` around the first match, HTML-escaped, with matches in <mark>."""
+    spans = [(m.start(), m.end(), _matches(_fold(m.group()), words, prefix)) for m in re.finditer(r"\w+", content)]
+    if not spans:
+        return html.escape(content)
+    first = next((i for i, span in enumerate(spans) if span[2]), 0)
+    start = max(0, min(first - size // 4, len(spans) - size))
+    window = spans[start:start + size]
+    parts = ["…" if start > 0 else ""]
+    position = window[0][0] if start > 0 else 0
+    for begin, end, matched in window:
+        parts.append(html.escape(content[position:begin]))
+        word = html.escape(content[begin:end])
+        parts.append(f"<mark>{word}</mark>" if matched else word)
+        position = end
+    parts.append("…" if start + size < len(spans) else html.escape(content[position:]))
+    return "".join(parts)
+
+
+def _bm25(tokens, words, prefix, idf, average_length, k1=1.2, b=0.75):
+    length_norm = k1 * (1 - b + b * len(tokens) / average_length)
+    score = 0.0
+    for i, word in enumerate(words):
+        if prefix and i == len(words) - 1:
+            frequency = sum(token.startswith(word) for token in tokens)
+        else:
+            frequency = tokens.count(word)
+        score += idf[word] * frequency * (k1 + 1) / (frequency + length_norm)
+    return score
+
+
+def search_messages(db, room_ids, query, limit, offset=0, candidates=CHAT_SEARCH_CANDIDATES,
+                    idf_window=CHAT_SEARCH_IDF_WINDOW, snippet_words=12):
+    """
+    Ranks the messages of `room_ids` matching `query` by BM25, best first. Only the newest `candidates`
+    matches are ranked: walking the index newest-first is cheap however common the words are, and in chat
+    the most relevant old messages are rarely wanted over recent ones. Returns ([(message, snippet)],
+    has_more); snippets are HTML-escaped with the matched words wrapped in <mark>.
+    """
+    words, prefix = parse_search_query(query)
+    if not words or not room_ids:
+        return [], False
+    matches = db.execute(
+        text(
+            "SELECT rowid AS seq, content FROM chat_messages_fts WHERE chat_messages_fts MATCH :expression "
+            "ORDER BY rowid DESC LIMIT :candidates"
+        ),
+        {"expression": search_expression(words, prefix, room_ids), "candidates": candidates},
+    ).all()
+    if not matches:
+        return [], False
+
+    frequencies, total = _document_frequencies(db, words, prefix, idf_window)
+    idf = {word: math.log((total - n + 0.5) / (n + 0.5) + 1) for word, n in frequencies.items()}
+    tokens = {row.seq: re.findall(r"\w+", _fold(row.content)) for row in matches}
+    average_length = max(1.0, sum(len(t) for t in tokens.values()) / len(tokens))
+    ranked = sorted(
+        matches,
+        key=lambda row: (-_bm25(tokens[row.seq], words, prefix, idf, average_length), -row.seq),
+    )
+    page = [row.seq for row in ranked[offset:offset + limit]]
+    has_more = len(ranked) > offset + limit
+    if not page:
+        return [], has_more
+
+    content = {row.seq: row.content for row in matches}
+    messages = {
+        message.seq: message
+        for message in db.query(models.ChatMessage).filter(models.ChatMessage.seq.in_(page))
+    }
+    results = [(messages[seq], _snippet(content[seq], words, prefix, snippet_words)) for seq in page]
+    return results, has_more
@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+import threading
+
+from ..config import CHAT_JSON_FLUSH_SECONDS
+
+# JSON files the app keeps changing (the chat user directory) are read once into memory, changed there,
+# and written back behind the callers.
+
+
+def write_atomic(path, text):
+    """
+    Replaces `path` with `text`. The new content goes to a temporary file in the same directory, which is
+    fsynced and renamed over the original: a crash leaves either the old file or the new one, never a
+    truncated mix.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    # The rename only survives a power loss once the directory itself is synced (not possible on Windows)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class JsonFileStore:
+    """
+    An in-memory copy of a JSON file with write-behind. Readers get the in-memory data; changes made within
+    `flush_interval` seconds of each other are coalesced into a single write of compact JSON (with
+    write_atomic). With `flush_interval` 0 every change is written straight away, still atomically.
+    """
+
+    def __init__(self, path, flush_interval=CHAT_JSON_FLUSH_SECONDS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()  # Guards the data and the bookkeeping
+        self._write_lock = threading.Lock()  # One write at a time, so an older version never lands last
+        self._data = None
+        self._version = 0
+        self._dirty = False
+        self._timer = None
+        self._stats = {"changes": 0, "writes": 0, "coalesced": 0, "failed_writes": 0}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read(self):
+        """The current data. Don't modify it in place; use update()."""
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """(data, version); the version changes with every update, so derived data can be cached against it."""
+        with self._lock:
+            if self._data is None:
+                data = self._load()
+                if data is None:
+                    # Not cached: the file may still be created (seeded) by someone else
+                    return {}, self._version
+                self._data = data
+            return self._data, self._version
+
+    def update(self, change):
+        """Applies `change(data)` to the in-memory copy and schedules a write. Returns what `change` returns."""
+        with self._lock:
+            if self._data is None:
+                self._data = self._load() or {}
+            result = change(self._data)
+            write_now = self._changed()
+        if write_now:
+            self.flush()
+        return result
+
+    def replace(self, data):
+        with self._lock:
+            self._data = data
+            write_now = self._changed()
+        if write_now:
+            self.flush()
+
+    def _changed(self):
+        """
+        Marks the data dirty. Returns True if the caller should flush() now, which it must do after releasing
+        _lock: flush() takes _write_lock first, and the file isn't written while readers wait on _lock.
+        """
+        self._version += 1
+        self._stats["changes"] += 1
+        if self._dirty:
+            self._stats["coalesced"] += 1
+        self._dirty = True
+        if self.flush_interval <= 0:
+            return True
+        self._schedule()
+        return False
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes pending changes now, if there are any."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                text = json.dumps(self._data, separators=(",", ":"), ensure_ascii=False)
+                self._dirty = False
+            try:
+                write_atomic(self.path, text)
+                self._stats["writes"] += 1
+            except OSError as e:
+                # The file on disk is still the previous version; try again later
+                print(f"Warning: Failed to write {self.path}: {e}")
+                with self._lock:
+                    self._stats["failed_writes"] += 1
+                    self._dirty = True
+                    if self.flush_interval > 0:
+                        self._schedule()
+
+    def close(self):
+        """Writes what is pending (on shutdown)."""
+        self.flush()
+
+    def metrics(self):
+        with self._lock:
+            return {**self._stats, "pending": self._dirty}
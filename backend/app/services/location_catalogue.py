@@ -0,0 +1,173 @@
+import os
+import json
+import threading
+
+from ..config import NAV_LOCATIONS_PATH, NAV_PHOTOS_DIR, NAV_CAMPUS_GRAPH_PATH, NAV_CATALOGUE_WATCH_SECONDS
+from . import navigation_service
+from .route_graph import reload_route_engine
+
+# The navigation location catalogue: location_key -> {"human_name", "description", "image_files"}.
+# It lives in a JSON file and can be changed at runtime. Each change replaces the catalogue dict as a
+# whole, so readers never see a half-updated catalogue, and then re-indexes only the locations that differ
+# (see navigation_service.precompute_db_embeddings).
+
+REQUIRED_FIELDS = {"human_name": str, "description": str, "image_files": list}
+
+_catalogue = None
+_catalogue_lock = threading.RLock()  # Serializes reloads and edits
+
+
+def validate_location(location_key, data):
+    if not isinstance(data, dict):
+        raise ValueError(f"Location '{location_key}' must be an object.")
+    for field, kind in REQUIRED_FIELDS.items():
+        if not isinstance(data.get(field), kind):
+            raise ValueError(f"Location '{location_key}' needs a '{field}' ({kind.__name__}).")
+    if not all(isinstance(name, str) and name and os.path.basename(name) == name for name in data["image_files"]):
+        raise ValueError(f"Location '{location_key}' has an invalid image file name.")
+    return {field: data[field] for field in REQUIRED_FIELDS}
+
+
+def load_location_catalogue(path=NAV_LOCATIONS_PATH):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return {key: validate_location(key, value) for key, value in data.items()}
+
+
+def save_location_catalogue(catalogue, path=NAV_LOCATIONS_PATH):
+    """Writes to a temp file first, so the watcher (or a crash) never sees a half-written catalogue."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(catalogue, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_catalogue():
+    """The current catalogue. Treat it as read-only; it is replaced, not modified, on every change."""
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                _catalogue = load_location_catalogue()
+    return _catalogue
+
+
+def apply_catalogue(catalogue, db_folder_path=NAV_PHOTOS_DIR):
+    """
+    Makes `catalogue` the live one. If the navigation models are loaded (or loading), new, changed and
+    removed locations are then re-indexed; otherwise the next warm-up simply uses the new catalogue.
+    """
+    global _catalogue
+    with _catalogue_lock:
+        _catalogue = catalogue
+        if navigation_service.navigation_status["state"] not in ("loading", "ready"):
+            return None
+        # get_catalogue is resolved under the index lock, so a warm-up still holding the old catalogue can't
+        # overwrite this update
+        return navigation_service.precompute_db_embeddings(get_catalogue, db_folder_path=db_folder_path)
+
+
+def reload_catalogue():
+    """Re-reads the catalogue and campus map files and applies any changes."""
+    with _catalogue_lock:
+        catalogue = load_location_catalogue()
+        reload_route_engine()
+        summary = apply_catalogue(catalogue)
+        print(f"Location catalogue reloaded ({len(catalogue)} locations): {summary}")
+        return summary
+
+
+def upsert_location(location_key, data):
+    """Adds or replaces one location, saves the catalogue file and re-indexes just that location."""
+    with _catalogue_lock:
+        catalogue = {**get_catalogue(), location_key: validate_location(location_key, data)}
+        save_location_catalogue(catalogue)
+        return apply_catalogue(catalogue)
+
+
+def add_photo(location_key, filename, image_bytes, db_folder_path=NAV_PHOTOS_DIR):
+    """
+    Saves a reference photo into the shared photo folder and adds it to a location. Raises KeyError if the
+    location doesn't exist, and FileExistsError if any location already lists a photo with that name (it
+    would be overwritten, and that location's embeddings would then describe the wrong image).
+    """
+    with _catalogue_lock:
+        catalogue = get_catalogue()
+        location = catalogue[location_key]
+        owner = next((key for key, value in catalogue.items() if filename in value["image_files"]), None)
+        if owner is not None:
+            raise FileExistsError(f"A photo named '{filename}' is already used by location '{owner}'.")
+        tmp_path = os.path.join(db_folder_path, f".{filename}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, os.path.join(db_folder_path, filename))
+        return upsert_location(location_key, {**location, "image_files": location["image_files"] + [filename]})
+
+
+def remove_location(location_key):
+    """Removes one location. Raises KeyError if it doesn't exist."""
+    with _catalogue_lock:
+        catalogue = dict(get_catalogue())
+        del catalogue[location_key]
+        save_location_catalogue(catalogue)
+        return apply_catalogue(catalogue)
+
+
+# --- File Watcher ---
+class CatalogueWatcher:
+    """
+    Polls the catalogue file, the campus map and the photo folder every `interval` seconds and reloads
+    when any of them changed. Polling (size and mtime only) keeps this dependency-free and works the same
+    on every platform and on network mounts.
+    """
+
+    def __init__(self, interval=NAV_CATALOGUE_WATCH_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = None
+
+    @staticmethod
+    def snapshot():
+        state = []
+        for path in (NAV_LOCATIONS_PATH, NAV_CAMPUS_GRAPH_PATH):
+            try:
+                stat = os.stat(path)
+                state.append((path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                state.append((path, None, None))
+        try:
+            with os.scandir(NAV_PHOTOS_DIR) as entries:
+                state.extend(sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in entries if e.is_file()))
+        except OSError:
+            pass
+        return state
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._snapshot = self.snapshot()
+        self._thread = threading.Thread(target=self._run, name="nav-catalogue-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = self.snapshot()
+            if current == self._snapshot:
+                continue
+            try:
+                reload_catalogue()
+                self._snapshot = current
+            except Exception as e:
+                # Most likely a file caught mid-edit; it is retried on the next poll
+                print(f"Warning: Failed to reload the location catalogue: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+catalogue_watcher = CatalogueWatcher()
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+from ..config import NAV_MATCH_CACHE_SIZE, NAV_MATCH_CACHE_PERCEPTUAL, NAV_MATCH_CACHE_MAX_DISTANCE
+from .navigation_service import load_image
+
+# digest: SHA-256 of the uploaded bytes; phash: 64-bit difference hash, or None when not computed
+MatchKey = namedtuple("MatchKey", ["digest", "phash"])
+
+
+def difference_hash(image_bytes):
+    """64-bit dHash: compares neighbouring pixels of a 9x8 grayscale thumbnail. None if the bytes don't decode."""
+    try:
+        image = load_image(image_bytes, max_side=64)
+    except Exception:
+        return None
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+class MatchCache:
+    """
+    Bounded LRU cache of navigation match results ((location_key or None, score) pairs) in front of the models.
+
+    Entries belong to one generation of the reference embeddings (ReferenceMatrices.generation). As soon
+    as a newer generation is seen the whole cache is dropped, and results computed against an older one
+    are never stored.
+    """
+
+    def __init__(self, max_entries=NAV_MATCH_CACHE_SIZE, perceptual=NAV_MATCH_CACHE_PERCEPTUAL,
+                 max_distance=NAV_MATCH_CACHE_MAX_DISTANCE):
+        self.max_entries = max(0, max_entries)
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self.generation = None
+        self._entries = OrderedDict()  # digest -> (phash, result), least recently used first
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key_for(self, image_bytes):
+        """Hashes an upload. The perceptual hash decodes the image, so call this off the event loop."""
+        if not self.enabled:
+            return None
+        phash = difference_hash(image_bytes) if self.perceptual else None
+        return MatchKey(hashlib.sha256(image_bytes).hexdigest(), phash)
+
+    def _sync_generation(self, generation):
+        # Caller holds the lock
+        if generation != self.generation:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, key, generation):
+        """Returns the cached result for this photo (or a near-duplicate of it), or None."""
+        if key is None:
+            return None
+        with self._lock:
+            self._sync_generation(generation)
+            entry = self._entries.get(key.digest)
+            if entry is not None:
+                self._entries.move_to_end(key.digest)
+                self._stats["hits"] += 1
+                return entry[1]
+            if key.phash is not None:
+                for digest, (phash, result) in self._entries.items():
+                    if phash is not None and bin(phash ^ key.phash).count("1") <= self.max_distance:
+                        self._entries.move_to_end(digest)
+                        self._stats["near_hits"] += 1
+                        return result
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, result, generation):
+        """Stores a result computed against the given generation of the reference embeddings."""
+        if key is None:
+            return
+        with self._lock:
+            if self.generation is not None and generation < self.generation:
+                return
+            self._sync_generation(generation)
+            self._entries[key.digest] = (key.phash, result)
+            self._entries.move_to_end(key.digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["near_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "perceptual": self.perceptual,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round((self._stats["hits"] + self._stats["near_hits"]) / lookups, 4) if lookups else 0.0,
+                "generation": self.generation,
+            }
+
+
+# Shared by every /navigation/find-path/ request in this process
+match_cache = MatchCache()
@@ -0,0 +1,191 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import (
+    NAV_BATCH_WINDOW_MS, NAV_MAX_BATCH_SIZE, NAV_INFERENCE_WORKERS, NAV_MAX_QUEUE_DEPTH, NAV_RETRY_AFTER_SECONDS
+)
+from .navigation_service import find_best_matches
+
+
+class NavigationBusyError(Exception):
+    """
+    Raised when the inference queue is full (or the service is shutting down); the caller should retry
+    after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after=NAV_RETRY_AFTER_SECONDS, message="Navigation service is busy, please retry shortly."):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class InferenceBatcher:
+    """
+    Gathers concurrent navigation requests into micro-batches.
+
+    The first request to arrive opens a batch window; everything that arrives before the window closes
+    (or until the batch is full) is matched together by `match_fn` on a dedicated, bounded thread pool,
+    so the event loop stays free and the models see one forward pass per batch instead of one per request.
+    Once `max_queue_depth` requests are waiting, new ones are rejected with NavigationBusyError.
+    """
+
+    def __init__(self, match_fn, max_batch_size=NAV_MAX_BATCH_SIZE, batch_window_ms=NAV_BATCH_WINDOW_MS,
+                 workers=NAV_INFERENCE_WORKERS, max_queue_depth=NAV_MAX_QUEUE_DEPTH):
+        self.match_fn = match_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = max(0.0, batch_window_ms) / 1000
+        self.workers = max(1, workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self._executor = None
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+        self._waiting = 0  # Requests accepted but not yet handed to a worker thread
+        self._stats = {"requests": 0, "rejected": 0, "failed": 0, "batches": 0, "batched_requests": 0}
+        # Recent samples (seconds) for the metrics endpoint
+        self._queue_waits = deque(maxlen=1000)
+        self._compute_times = deque(maxlen=1000)
+
+    def _ensure_started(self):
+        # The queue and worker task must belong to the running event loop, so they are created on first use
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nav-inference")
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, photo):
+        """Queues one photo and waits for its own (location_key or None, score) result."""
+        if self._waiting >= self.max_queue_depth:
+            self._stats["rejected"] += 1
+            raise NavigationBusyError()
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting += 1
+        self._stats["requests"] += 1
+        self._queue.put_nowait((photo, future, loop.time()))
+        return await future
+
+    async def _collect_batch(self, batch):
+        """Fills `batch` (in place, so a cancelled worker still knows which requests it had taken)."""
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = []
+                await self._collect_batch(batch)
+                # Wait for a free worker thread; requests keep queueing (and counting towards the limit) meanwhile
+                await self._slots.acquire()
+                task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                batch = []  # Owned by _run_batch from here on
+        except asyncio.CancelledError:
+            # Requests already taken off the queue (being collected, or waiting for a worker) would otherwise
+            # never get an answer
+            self._fail_shutting_down(batch)
+            raise
+
+    def _fail_shutting_down(self, batch):
+        for _, future, _ in batch:
+            self._waiting -= 1
+            if not future.done():
+                future.set_exception(NavigationBusyError(message="Navigation service is shutting down, please retry shortly."))
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            started = loop.time()
+            self._waiting -= len(batch)
+            # Callers that gave up (e.g. the client disconnected) don't need to be matched
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                return
+            for _, _, queued_at in batch:
+                self._queue_waits.append(started - queued_at)
+            try:
+                results = await loop.run_in_executor(self._executor, self.match_fn, [photo for photo, _, _ in batch])
+            except Exception as e:
+                self._stats["failed"] += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self._compute_times.append(loop.time() - started)
+            self._stats["batches"] += 1
+            self._stats["batched_requests"] += len(batch)
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        """Queue depth plus queue-wait vs. compute time, so overload can be told apart from slow inference."""
+        waits, computes = list(self._queue_waits), list(self._compute_times)
+        return {
+            **self._stats,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "workers": self.workers,
+            "max_batch_size": self.max_batch_size,
+            "batch_window_ms": self.batch_window * 1000,
+            "avg_batch_size": round(self._stats["batched_requests"] / self._stats["batches"], 2) if self._stats["batches"] else 0.0,
+            "queue_wait_ms": {
+                "p50": round(_percentile(waits, 0.50) * 1000, 2),
+                "p95": round(_percentile(waits, 0.95) * 1000, 2),
+                "max": round(max(waits, default=0.0) * 1000, 2),
+            },
+            "compute_ms": {
+                "p50": round(_percentile(computes, 0.50) * 1000, 2),
+                "p95": round(_percentile(computes, 0.95) * 1000, 2),
+                "max": round(max(computes, default=0.0) * 1000, 2),
+            },
+        }
+
+    async def shutdown(self):
+        """Stops the batch worker and fails (with NavigationBusyError, a 503) every request not yet matched."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._queue is not None:
+            queued = []
+            while not self._queue.empty():
+                queued.append(self._queue.get_nowait())
+            self._fail_shutting_down(queued)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Shared by every /navigation/find-path/ request in this process
+inference_batcher = InferenceBatcher(find_best_matches)
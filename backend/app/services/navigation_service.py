@@ -1,141 +1,688 @@
-
-
-import open_clip
 import torch
 from PIL import Image
 import os
+import io
+import re
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import itertools
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from ..config import (
+    NAV_EMBEDDING_CACHE_PATH, NAV_IMAGE_BATCH_SIZE, NAV_PREPROCESS_WORKERS, NAV_MAX_IMAGE_SIDE, NAV_MAX_IMAGE_PIXELS,
+    NAV_INDEX_TYPE, NAV_INDEX_SEARCH_K, NAV_PER_LOCATION_TOP_K, NAV_IVF_MIN_VECTORS, NAV_IVF_NLIST, NAV_IVF_NPROBE,
+    NAV_PRECISION, NAV_TORCH_THREADS, NAV_MODELS
+)
+from .vector_index import build_index
 
 # --- Configuration ---
 SIMILARITY_THRESHOLD = 0.25 # Threshold on the combined score (can be lower)
 # How much to trust image-vs-image vs. image-vs-text. 0.6 means 60% of the score comes from image matching.
 IMAGE_TO_IMAGE_WEIGHT = 0.6
 IMAGE_TO_TEXT_WEIGHT = 0.4
+# Each location's text vector is the average of these prompts (prompt ensembling); {name} is its human_name
+TEXT_PROMPT_TEMPLATES = [
+    "{description}",
+    "{name}: {description}",
+    "a photo of the {name}.",
+    "a photo of the {name} on a college campus.",
+    "a phone photo taken at the {name}.",
+]
+TEXT_PROMPT_BATCH_SIZE = 256
+
+# Architecture and pretrained tag for each model that can be part of the ensemble (see NAV_MODELS)
+MODEL_SPECS = {
+    'laion': ('ViT-B-32', 'laion2b_s34b_b79k'),
+    'openai': ('ViT-B-32', 'openai'),
+}
+# Bump this whenever the way embeddings are computed changes, so old cache files are ignored.
+EMBEDDING_CACHE_VERSION = 1
 
 # --- Model Loading ---
-print("Loading MULTI-MODAL OpenCLIP models... (This may take a while on first run)")
+# Models are loaded on first use (or by warm_up() at startup), never at import time, so processes that
+# only serve canteen/library/chat traffic don't pay for them.
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
 models = {}
 preprocessors = {}
 tokenizer = None
 
-# We use two models for a robust ensemble
-models['laion'], _, preprocessors['laion'] = open_clip.create_model_and_transforms('ViT-B-32', pretrained='laion2b_s34b_b79k')
-models['openai'], _, preprocessors['openai'] = open_clip.create_model_and_transforms('ViT-B-32', pretrained='openai')
-tokenizer = open_clip.get_tokenizer('ViT-B-32')
+# Per location and model: every reference photo's embedding as an (num_photos, dim) stack under "image",
+# and the description's (1, dim) embedding under "text"
+db_embeddings = {
+    "image": {},
+    "text": {}
+}
 
-for name in models:
-    models[name].to(device)
-print(f"All models loaded successfully on '{device}'.")
+# What each location's embeddings were last built from (see _location_signature), so a reload can skip
+# locations that haven't changed
+indexed_locations = {}
+
+# "cold" -> "loading" -> "ready" (or "failed"), reported by the readiness endpoint
+navigation_status = {"state": "cold", "error": None, "warm_up_seconds": None}
+
+# --- Inference Profile ---
+# What was actually applied at load time (e.g. bf16 falls back to fp32 on CPUs without bf16 support)
+PRECISIONS = ("autocast", "fp32", "bf16", "int8")
+inference_profile = {"precision": None, "threads": None, "models": []}
+_input_dtype = torch.float32
+
+def _bf16_supported():
+    if device == "cuda":
+        return torch.cuda.is_bf16_supported()
+    checks = [getattr(torch.cpu, name, None) for name in ("_is_avx512_bf16_supported", "_is_amx_tile_supported")]
+    return any(check() for check in checks if check is not None)
+
+def _apply_precision(model, precision):
+    """Converts a freshly loaded model to the requested precision and returns the precision actually used."""
+    global _input_dtype
+    if precision == "bf16":
+        if not _bf16_supported():
+            print("Warning: bf16 is not supported on this device, falling back to fp32.")
+            return model, "fp32"
+        _input_dtype = torch.bfloat16
+        return model.to(torch.bfloat16), "bf16"
+    if precision == "int8":
+        if device != "cpu":
+            print("Warning: int8 dynamic quantization only runs on CPU, falling back to autocast.")
+            return model, "autocast"
+        try:
+            # Only the image tower is quantized: queries never touch the text tower, and open_clip's text
+            # transformer reads Linear weights directly, which quantized layers don't support
+            model.visual = torch.ao.quantization.quantize_dynamic(model.visual, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception as e:
+            print(f"Warning: int8 quantization failed, falling back to fp32: {e}")
+            return model, "fp32"
+        return model, "int8"
+    return model, precision
+
+def _inference_context():
+    """no_grad plus, for the default "autocast" profile, mixed precision on the current device."""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.no_grad())
+    if inference_profile["precision"] == "autocast":
+        stack.enter_context(torch.amp.autocast(device_type=device))
+    return stack
+
+_models_loaded = False
+_load_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+_warm_up_thread_lock = threading.Lock()
+_index_lock = threading.Lock()  # One (re)index at a time
+
+def load_models():
+    """Loads the OpenCLIP ensemble exactly once; safe to call from several threads."""
+    global tokenizer, _models_loaded
+    if _models_loaded:
+        return
+    with _load_lock:
+        if _models_loaded:
+            return
+        import open_clip
+
+        unknown = [name for name in NAV_MODELS if name not in MODEL_SPECS]
+        if unknown or not NAV_MODELS:
+            raise ValueError(f"NAV_MODELS must name one or more of {sorted(MODEL_SPECS)}, got {NAV_MODELS}.")
+        if NAV_PRECISION not in PRECISIONS:
+            raise ValueError(f"NAV_PRECISION must be one of {PRECISIONS}, got '{NAV_PRECISION}'.")
+        if NAV_TORCH_THREADS > 0:
+            torch.set_num_threads(NAV_TORCH_THREADS)
+
+        print("Loading MULTI-MODAL OpenCLIP models... (This may take a while on first run)")
+        # By default we use two models for a robust ensemble
+        precision = NAV_PRECISION
+        for name in NAV_MODELS:
+            arch, pretrained = MODEL_SPECS[name]
+            model, _, preprocessors[name] = open_clip.create_model_and_transforms(arch, pretrained=pretrained)
+            model, precision = _apply_precision(model.to(device).eval(), NAV_PRECISION)
+            models[name] = model
+            db_embeddings["image"].setdefault(name, {})
+            db_embeddings["text"].setdefault(name, {})
+        tokenizer = open_clip.get_tokenizer('ViT-B-32')
+        inference_profile.update({"precision": precision, "threads": torch.get_num_threads(), "models": list(models)})
+        _models_loaded = True
+        print(f"All models loaded successfully on '{device}' (profile: {inference_profile}).")
+
+def is_ready():
+    return navigation_status["state"] == "ready"
+
+def warm_up(location_data, db_folder_path="database_photos"):
+    """Loads the models and builds the reference embeddings. Does nothing if that already happened."""
+    with _warm_up_lock:
+        if is_ready():
+            return
+        navigation_status.update({"state": "loading", "error": None})
+        started = time.perf_counter()
+        try:
+            load_models()
+            precompute_db_embeddings(location_data, db_folder_path=db_folder_path)
+        except Exception as e:
+            navigation_status.update({"state": "failed", "error": str(e)})
+            raise
+        navigation_status.update({"state": "ready", "warm_up_seconds": round(time.perf_counter() - started, 2)})
+
+def start_background_warm_up(location_data, db_folder_path="database_photos"):
+    """Runs warm_up() on a daemon thread so the app can start serving other traffic right away."""
+    global _warm_up_thread
+    with _warm_up_thread_lock:
+        if is_ready() or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        def run():
+            try:
+                warm_up(location_data, db_folder_path)
+            except Exception as e:
+                print(f"Warning: Failed to initialize navigation models: {e}")
+        _warm_up_thread = threading.Thread(target=run, name="nav-warm-up", daemon=True)
+        _warm_up_thread.start()
+
+@dataclass(frozen=True)
+class ReferenceMatrices:
+    """
+    The reference embeddings prepared for scoring. Each model gets a vector index over every individual
+    reference photo (labelled with its location's position in location_keys) and a normalized
+    (num_locations, dim) text matrix whose row i belongs to location_keys[i].
+    """
+    location_keys: list
+    image_index: dict  # model_name -> VectorIndex over all reference photos
+    text: dict         # model_name -> (num_locations, dim) tensor
+    generation: int = 0  # Increases with every rebuild, so results computed against older snapshots can be told apart
 
+# Rebuilt (never mutated) after every precompute, so a running query always sees one consistent snapshot
+reference_matrices = ReferenceMatrices(location_keys=[], image_index={}, text={})
+_reference_generations = itertools.count(1)
 
-# This will store the final, averaged embeddings for each location
-db_embeddings = {
-    "image": {name: {} for name in models},
-    "text": {name: {} for name in models}
-}
+def load_image(source, max_side=NAV_MAX_IMAGE_SIDE):
+    """
+    Opens an image from a path, raw bytes, a file-like object or an existing PIL image, and shrinks it so
+    its longest side is at most max_side. JPEGs are downscaled while decoding (draft mode), so a 48MP phone
+    photo never gets fully decoded into memory. The models only look at 224px crops anyway.
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        # Image.open only reads the header, so oversized images are rejected before any pixels are decoded
+        if image.width * image.height > NAV_MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image is too large ({image.width}x{image.height} pixels).")
+        if image.format == "JPEG":
+            image.draft("RGB", (max_side, max_side))
+    if max(image.size) > max_side:
+        image = image.copy() if image is source else image
+        image.thumbnail((max_side, max_side), Image.BICUBIC)
+    else:
+        image.load()
+    return image
 
-def get_image_embedding(image_path, model_name):
-    """Generates a normalized embedding for a single image."""
+def get_image_embedding(image, model_name):
+    """Generates a normalized embedding for a single image (path, bytes, file-like object or PIL image)."""
     try:
         preprocessor = preprocessors[model_name]
-        image = preprocessor(Image.open(image_path)).unsqueeze(0).to(device)
-        with torch.no_grad(), torch.amp.autocast(device_type='cuda' if torch.cuda.is_available() else 'cpu'):
+        image = preprocessor(load_image(image)).unsqueeze(0).to(device, dtype=_input_dtype)
+        with _inference_context():
             embedding = models[model_name].encode_image(image)
             embedding /= embedding.norm(dim=-1, keepdim=True)
-        return embedding
+        return embedding.float()
     except Exception as e:
         return None
 
 def get_text_embedding(text, model_name):
     """Generates a normalized embedding for a text description."""
-    with torch.no_grad(), torch.amp.autocast(device_type='cuda' if torch.cuda.is_available() else 'cpu'):
+    with _inference_context():
         tokens = tokenizer(text).to(device)
         embedding = models[model_name].encode_text(tokens)
         embedding /= embedding.norm(dim=-1, keepdim=True)
-    return embedding
+    return embedding.float()
 
-def precompute_db_embeddings(location_data, db_folder_path="database_photos"):
+def location_prompts(data):
+    """The prompts a location's text prototype is built from (duplicates removed, order kept)."""
+    name = data.get("human_name") or ""
+    prompts = [template.format(name=name, description=data["description"]) for template in TEXT_PROMPT_TEMPLATES]
+    return list(dict.fromkeys(prompts))
+
+def get_text_prototypes(prompt_lists, model_name):
+    """
+    Encodes the prompts of many locations together (in large batches rather than one call per prompt)
+    and averages each location's normalized prompt embeddings into one normalized prototype.
+    Returns a (len(prompt_lists), dim) tensor.
+    """
+    flat = [prompt for prompts in prompt_lists for prompt in prompts]
+    chunks = []
+    with _inference_context():
+        for start in range(0, len(flat), TEXT_PROMPT_BATCH_SIZE):
+            tokens = tokenizer(flat[start:start + TEXT_PROMPT_BATCH_SIZE]).to(device)
+            chunks.append(models[model_name].encode_text(tokens).float())
+    embeddings = torch.nn.functional.normalize(torch.cat(chunks), dim=-1)
+    prototypes, start = [], 0
+    for prompts in prompt_lists:
+        prototypes.append(embeddings[start:start + len(prompts)].mean(dim=0))
+        start += len(prompts)
+    return torch.nn.functional.normalize(torch.stack(prototypes), dim=-1)
+
+# --- Batched Image Encoding ---
+# Stats from the most recent encode_images() call, so cold-start indexing speed can be tracked over time
+indexing_stats = {"images": 0, "seconds": 0.0, "images_per_sec": 0.0, "batch_size": NAV_IMAGE_BATCH_SIZE}
+
+# One decoding pool for reference indexing and query batches alike, so a request never waits for threads
+# to start
+_preprocess_pool = None
+_preprocess_pool_lock = threading.Lock()
+
+def _get_preprocess_pool():
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is None:
+            _preprocess_pool = ThreadPoolExecutor(max_workers=NAV_PREPROCESS_WORKERS, thread_name_prefix="nav-preprocess")
+        return _preprocess_pool
+
+def shutdown_preprocess_pool():
+    """Stops the decoding threads (on shutdown); the next encode_images() call starts them again."""
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        pool, _preprocess_pool = _preprocess_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _preprocess_groups(model_names):
+    """Groups models that share a preprocessing config, so each photo is only preprocessed once per group."""
+    groups = defaultdict(list)
+    for model_name in model_names:
+        groups[_preprocess_config(model_name)].append(model_name)
+    return list(groups.values())
+
+def _load_and_preprocess(source, groups):
+    """Decodes one image and runs it through each group's preprocessor. Returns None if it can't be decoded."""
+    try:
+        image = load_image(source)
+        return [preprocessors[group[0]](image) for group in groups]
+    except Exception as e:
+        print(f"Warning: Could not decode image: {e}")
+        return None
+
+def encode_images(sources, model_names=None, batch_size=NAV_IMAGE_BATCH_SIZE, record_stats=True):
+    """
+    Encodes many images (anything load_image() accepts) with every requested model.
+    Decoding and preprocessing run in a thread pool, one batch ahead of the models, and each model
+    sees fixed-size batches instead of one image at a time.
+    Returns {model_name: [normalized (dim,) CPU tensor, or None if the image failed, ...]} in input order.
+    Query traffic passes record_stats=False so indexing_stats only ever describes reference indexing.
+    """
+    model_names = list(model_names or models)
+    groups = _preprocess_groups(model_names)
+    results = {name: [] for name in model_names}
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+    started = time.perf_counter()
+
+    pool = _get_preprocess_pool()
+    pending = [pool.submit(_load_and_preprocess, source, groups) for source in batches[0]] if batches else []
+    for batch_index in range(len(batches)):
+        current = pending
+        # Queue up the next batch so decoding overlaps with the forward passes below
+        if batch_index + 1 < len(batches):
+            pending = [pool.submit(_load_and_preprocess, source, groups) for source in batches[batch_index + 1]]
+        preprocessed = [future.result() for future in current]
+        valid = [i for i, item in enumerate(preprocessed) if item is not None]
+        row_of = {image_index: row for row, image_index in enumerate(valid)}
+
+        for group_index, group in enumerate(groups):
+            batch_embeddings = {}
+            if valid:
+                pixels = torch.stack([preprocessed[i][group_index] for i in valid]).to(device, dtype=_input_dtype)
+                for model_name in group:
+                    with _inference_context():
+                        embedding = models[model_name].encode_image(pixels)
+                        embedding /= embedding.norm(dim=-1, keepdim=True)
+                    batch_embeddings[model_name] = embedding.float().cpu()
+            for model_name in group:
+                for image_index in range(len(preprocessed)):
+                    row = row_of.get(image_index)
+                    results[model_name].append(batch_embeddings[model_name][row] if row is not None else None)
+
+    elapsed = time.perf_counter() - started
+    if not record_stats:
+        return results
+    indexing_stats.update({
+        "images": len(sources),
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(len(sources) / elapsed, 2) if elapsed > 0 else 0.0,
+        "batch_size": batch_size,
+    })
+    print(f"Encoded {len(sources)} images with {len(model_names)} models in {elapsed:.2f}s "
+          f"({indexing_stats['images_per_sec']} images/sec, batch size {batch_size}).")
+    return results
+
+# --- Persistent Embedding Cache ---
+# On disk the cache looks like:
+#   {"version": 1, "models": {<model fingerprint>: {"images": {<sha256 of file>: tensor}, "texts": {<sha256 of prompt list>: prototype tensor}}}}
+# The fingerprint covers the model name, pretrained tag and preprocessing config, so changing any
+# of them simply misses the cache instead of serving stale vectors.
+
+def _preprocess_config(model_name):
+    """Returns a stable string describing how images are preprocessed for a model."""
+    cfg = getattr(models[model_name].visual, "preprocess_cfg", None)
+    if cfg:
+        config = json.dumps(cfg, sort_keys=True, default=str)
+    else:
+        # Older open_clip versions don't expose the config, fall back to the transform repr (minus memory addresses)
+        config = re.sub(r" at 0x[0-9a-fA-F]+", "", repr(preprocessors[model_name]))
+    # load_image() downscales before the model's own transforms run, so that is part of the config too
+    return f"max_side={NAV_MAX_IMAGE_SIDE}|{config}"
+
+def model_fingerprint(model_name):
+    """Identifies the exact encoder an embedding came from (reduced precision gives slightly different vectors)."""
+    arch, pretrained = MODEL_SPECS[model_name]
+    precision = inference_profile["precision"]
+    return f"{model_name}|{arch}|{pretrained}|precision={precision}|{_preprocess_config(model_name)}"
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def load_embedding_cache(cache_path=NAV_EMBEDDING_CACHE_PATH):
+    """Loads the embedding cache from disk, returning an empty one if it is missing, unreadable or outdated."""
+    empty = {"version": EMBEDDING_CACHE_VERSION, "models": {}}
+    if not os.path.exists(cache_path):
+        return empty
+    try:
+        cache = torch.load(cache_path, map_location="cpu", weights_only=True)
+    except Exception as e:
+        print(f"Warning: Could not read embedding cache '{cache_path}', rebuilding it: {e}")
+        return empty
+    if not isinstance(cache, dict) or cache.get("version") != EMBEDDING_CACHE_VERSION:
+        print(f"Embedding cache '{cache_path}' is from an older version, rebuilding it.")
+        return empty
+    return cache
+
+def save_embedding_cache(cache, cache_path=NAV_EMBEDDING_CACHE_PATH):
+    """Writes the cache to a temp file and renames it into place so a crash never leaves a half-written cache."""
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    torch.save(cache, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+def _location_signature(data, db_folder_path):
+    """Cheap change detector for one location: its name and description plus the name, size and mtime of each photo."""
+    files = []
+    for filename in data["image_files"]:
+        try:
+            stat = os.stat(os.path.join(db_folder_path, filename))
+            files.append((filename, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            files.append((filename, None, None))
+    return (data.get("human_name"), data["description"], os.path.abspath(db_folder_path), tuple(files))
+
+def precompute_db_embeddings(location_data, db_folder_path="database_photos", cache_path=NAV_EMBEDDING_CACHE_PATH):
     """
     Pre-computes embeddings for both images and text descriptions for all locations.
-    It AVERAGES the embeddings of all images for a single location to create a robust representation.
+    Every photo's embedding is kept, so locations photographed from very different angles still match.
+    Embeddings are looked up in the on-disk cache first, so only new or changed photos are encoded.
+
+    Calling it again with an updated catalogue only touches locations whose description or photos changed
+    (and drops removed ones); the new scoring snapshot is swapped in at the end, so queries already
+    running keep using the previous one. Returns a summary of what changed.
+
+    location_data may also be a zero-argument function returning the catalogue. It is called once the
+    index lock is held, so when several updates race the last one to run always indexes the newest data.
     """
     print("Pre-computing multi-modal embeddings for all locations...")
-    
+    load_models()
+    with _index_lock:
+        if callable(location_data):
+            location_data = location_data()
+        return _precompute_db_embeddings(location_data, db_folder_path, cache_path)
+
+def _precompute_db_embeddings(location_data, db_folder_path, cache_path):
+    cache = load_embedding_cache(cache_path)
+    sections = {}
+    for model_name in models:
+        section = cache["models"].setdefault(model_fingerprint(model_name), {"images": {}, "texts": {}})
+        # Entries we touch this run are carried over, everything else is dropped when the cache is saved
+        sections[model_name] = {"old": section, "images": {}, "texts": {}, "cached_images": set(section["images"])}
+    encoded, reused = 0, 0
+    location_hashes = {}   # location_key -> content hashes of its photos
+    uncached_images = {}   # content hash -> raw bytes, for photos missing from the cache
+    uncached_texts = defaultdict(list)  # model_name -> (location_key, prompts hash, prompts) missing from the cache
+    text_hashes = {}       # location_key -> hash of its prompts
+    summary = {"added": [], "updated": [], "removed": [], "unchanged": 0}
+
+    # --- 0. Drop removed locations and skip the ones that haven't changed since the last run ---
+    for location_key in [key for key in indexed_locations if key not in location_data]:
+        del indexed_locations[location_key]
+        for kind in ("image", "text"):
+            for model_name in models:
+                db_embeddings[kind][model_name].pop(location_key, None)
+        summary["removed"].append(location_key)
+    signatures = {}
     for location_key, data in location_data.items():
-        # --- 1. Process Text Description ---
-        description = data["description"]
-        for model_name in models:
-            db_embeddings["text"][model_name][location_key] = get_text_embedding(description, model_name)
+        signatures[location_key] = _location_signature(data, db_folder_path)
+        previous = indexed_locations.get(location_key)
+        if previous is not None and previous["signature"] == signatures[location_key]:
+            # Still in use, so its cache entries must survive the pruning below
+            for model_name, section in sections.items():
+                for file_hash in previous["file_hashes"]:
+                    if file_hash in section["old"]["images"]:
+                        section["images"][file_hash] = section["old"]["images"][file_hash]
+                if previous["text_hash"] in section["old"]["texts"]:
+                    section["texts"][previous["text_hash"]] = section["old"]["texts"][previous["text_hash"]]
+            summary["unchanged"] += 1
+            continue
+        summary["updated" if previous is not None else "added"].append(location_key)
 
-        # --- 2. Process all associated Images ---
-        image_files = data["image_files"]
-        # Group embeddings from each model
-        temp_image_embeddings = defaultdict(list)
-        
-        for filename in image_files:
+    for location_key, data in location_data.items():
+        if location_key not in summary["added"] and location_key not in summary["updated"]:
+            continue
+        # --- 1. Look up the Text Prototype (missing ones are encoded in one batch below) ---
+        prompts = location_prompts(data)
+        text_hash = _sha256(json.dumps(prompts).encode("utf-8"))
+        text_hashes[location_key] = text_hash
+        for model_name in models:
+            section = sections[model_name]
+            embedding = section["old"]["texts"].get(text_hash)
+            if embedding is None:
+                uncached_texts[model_name].append((location_key, text_hash, prompts))
+                continue
+            reused += 1
+            section["texts"][text_hash] = embedding
+            db_embeddings["text"][model_name][location_key] = embedding.unsqueeze(0).to(device)
+
+        # --- 2. Hash all associated Images (encoding happens in batches below) ---
+        file_hashes = []
+        for filename in data["image_files"]:
             img_path = os.path.join(db_folder_path, filename)
             if os.path.exists(img_path):
-                for model_name in models:
-                    embedding = get_image_embedding(img_path, model_name)
-                    if embedding is not None:
-                        temp_image_embeddings[model_name].append(embedding)
+                with open(img_path, "rb") as f:
+                    image_bytes = f.read()
+                file_hash = _sha256(image_bytes)
+                file_hashes.append(file_hash)
+                if any(file_hash not in sections[name]["old"]["images"] for name in models):
+                    uncached_images[file_hash] = image_bytes
             else:
                 print(f"Warning: Image file not found: {img_path}")
+        location_hashes[location_key] = file_hashes
+
+    # --- 3. Encode every missing text prototype, all locations at once ---
+    for model_name, pending in uncached_texts.items():
+        prototypes = get_text_prototypes([prompts for _, _, prompts in pending], model_name).cpu()
+        for (location_key, text_hash, _), embedding in zip(pending, prototypes):
+            sections[model_name]["texts"][text_hash] = embedding
+            db_embeddings["text"][model_name][location_key] = embedding.unsqueeze(0).to(device)
+            encoded += 1
+
+    # --- 4. Encode every new or changed photo in fixed-size batches ---
+    if uncached_images:
+        uncached_hashes = list(uncached_images)
+        new_embeddings = encode_images([io.BytesIO(uncached_images[h]) for h in uncached_hashes])
+        for model_name, embeddings in new_embeddings.items():
+            old_images = sections[model_name]["old"]["images"]
+            for file_hash, embedding in zip(uncached_hashes, embeddings):
+                if embedding is not None and file_hash not in old_images:
+                    old_images[file_hash] = embedding
+                    encoded += 1
+        uncached_images.clear()
+
+    for location_key, file_hashes in location_hashes.items():
+        indexed_locations[location_key] = {
+            "signature": signatures[location_key],
+            "file_hashes": file_hashes,
+            "text_hash": text_hashes[location_key],
+        }
+        # Group embeddings from each model
+        temp_image_embeddings = defaultdict(list)
+        for file_hash in file_hashes:
+            for model_name in models:
+                section = sections[model_name]
+                embedding = section["old"]["images"].get(file_hash)
+                if embedding is None:
+                    continue  # The photo could not be decoded
+                if file_hash not in section["images"] and file_hash in section["cached_images"]:
+                    reused += 1
+                section["images"][file_hash] = embedding
+                temp_image_embeddings[model_name].append(embedding.unsqueeze(0).to(device))
         
-        # Average the image embeddings for each model to get a single, robust vector
+        # Keep every photo's embedding; the vector index compares a query against each view separately
         for model_name in models:
             if temp_image_embeddings[model_name]:
-                avg_embedding = torch.mean(torch.cat(temp_image_embeddings[model_name]), dim=0, keepdim=True)
-                db_embeddings["image"][model_name][location_key] = avg_embedding
-                print(f"  - Cached '{location_key}' ({len(image_files)} images, description) for model '{model_name}'")
-
-    print("Database multi-modal embedding cache is ready.")
+                db_embeddings["image"][model_name][location_key] = torch.cat(temp_image_embeddings[model_name])
+                print(f"  - Cached '{location_key}' ({len(file_hashes)} images, description) for model '{model_name}'")
+            else:
+                db_embeddings["image"][model_name].pop(location_key, None)
+
+    # Only rewrite the cache file when something was actually added or dropped
+    stale = False
+    for model_name, section in sections.items():
+        if section["cached_images"] != set(section["images"]) or set(section["old"]["texts"]) != set(section["texts"]):
+            stale = True
+        cache["models"][model_fingerprint(model_name)] = {"images": section["images"], "texts": section["texts"]}
+    if stale:
+        try:
+            save_embedding_cache(cache, cache_path)
+        except OSError as e:
+            print(f"Warning: Could not write embedding cache '{cache_path}': {e}")
+
+    # Swapping in a new snapshot is a single assignment; nothing is rebuilt if the catalogue is unchanged
+    global reference_matrices
+    if summary["added"] or summary["updated"] or summary["removed"] or not reference_matrices.generation:
+        reference_matrices = build_reference_matrices()
+
+    print(f"Database multi-modal embedding cache is ready ({encoded} encoded, {reused} loaded from '{cache_path}').")
+    return {**summary, "encoded": encoded, "reused": reused, "generation": reference_matrices.generation}
+
+def build_reference_matrices():
+    """Builds each model's photo index and packs the text vectors into one contiguous, normalized matrix."""
+    # Only locations with both an image and a text vector for every model can be scored fairly
+    location_keys = [
+        key for key in db_embeddings["image"][next(iter(models))]
+        if all(key in db_embeddings["image"][name] and key in db_embeddings["text"][name] for name in models)
+    ]
+    image_index, text = {}, {}
+    for model_name in models:
+        if location_keys:
+            stacks = [db_embeddings["image"][model_name][key] for key in location_keys]
+            vectors = torch.cat(stacks).float().cpu().numpy()
+            labels = [position for position, stack in enumerate(stacks) for _ in range(len(stack))]
+            # Approximate search only pays off once there are enough photos to cluster
+            kind = NAV_INDEX_TYPE if len(vectors) >= NAV_IVF_MIN_VECTORS else "flat"
+            options = {"nlist": NAV_IVF_NLIST or None, "nprobe": NAV_IVF_NPROBE or None} if kind == "ivf" else {}
+            image_index[model_name] = build_index(kind, vectors, labels, **options)
+            rows = [db_embeddings["text"][model_name][key] for key in location_keys]
+            text[model_name] = torch.nn.functional.normalize(torch.cat(rows).float(), dim=-1).contiguous()
+    return ReferenceMatrices(
+        location_keys=location_keys, image_index=image_index, text=text, generation=next(_reference_generations)
+    )
+
+def score_locations(user_embeddings, matrices, weights=None):
+    """
+    Scores a batch of queries against every location at once. Per model, the photo index returns each
+    location's best image-to-image similarity (mean of its NAV_PER_LOCATION_TOP_K closest photos) and a
+    single (batch, dim) x (dim, num_locations) product gives the image-to-text similarities. The per-model
+    scores are averaged and blended with the image/text weights (IMAGE_TO_IMAGE_WEIGHT/IMAGE_TO_TEXT_WEIGHT
+    unless `weights` overrides them).
+    Returns a (batch, num_locations) tensor, or None when no model produced query embeddings.
+    """
+    image_weight, text_weight = weights if weights is not None else (IMAGE_TO_IMAGE_WEIGHT, IMAGE_TO_TEXT_WEIGHT)
+    total = None
+    used_models = 0
+    num_locations = len(matrices.location_keys)
+    for model_name in models:
+        user_emb = user_embeddings.get(model_name)
+        if user_emb is None or model_name not in matrices.image_index:
+            continue
+        query = torch.nn.functional.normalize(user_emb.float(), dim=-1)
+        index = matrices.image_index[model_name]
+        # Exact search simply scores every photo; approximate search looks at the nearest few only
+        search_k = len(index) if index.kind == "flat" else NAV_INDEX_SEARCH_K
+        image_scores = index.label_scores(query.cpu().numpy(), num_locations, search_k, NAV_PER_LOCATION_TOP_K)
+        text_scores = query @ matrices.text[model_name].T
+        weighted = torch.from_numpy(image_scores).to(text_scores.device) * image_weight + text_scores * text_weight
+        total = weighted if total is None else total + weighted
+        used_models += 1
+    if total is None:
+        return None
+    return total / used_models
+
+def top_k_locations(user_embeddings, k=1, matrices=None):
+    """For each query row, returns the k best (location_key, combined_score) pairs, best first."""
+    matrices = matrices if matrices is not None else reference_matrices
+    batch_size = max((emb.shape[0] for emb in user_embeddings.values() if emb is not None), default=1)
+    if not matrices.location_keys:
+        return [[] for _ in range(batch_size)]
+    scores = score_locations(user_embeddings, matrices)
+    if scores is None:
+        # Mirrors the per-location fallback of 0 when no query embedding could be computed
+        scores = torch.zeros(batch_size, len(matrices.location_keys))
+    values, indices = torch.topk(scores, min(k, len(matrices.location_keys)), dim=-1)
+    return [
+        [(matrices.location_keys[i], v) for i, v in zip(row_indices, row_values)]
+        for row_indices, row_values in zip(indices.tolist(), values.tolist())
+    ]
+
+def find_best_matches(user_photos):
+    """
+    Matches a batch of user photos (anything load_image() accepts) in one forward pass per model.
+    Returns one (location_key or None, score) pair per photo, in input order.
+    Photos that can't be decoded get (None, None).
+    """
+    # Take one snapshot so a concurrent rebuild can't change the matrices halfway through scoring
+    matrices = reference_matrices
+    results = [(None, None)] * len(user_photos)
+    if not user_photos:
+        return results
+
+    # Generate embeddings for the user's photos from both models
+    encoded = encode_images(user_photos, batch_size=len(user_photos), record_stats=False)
+    valid = [i for i in range(len(user_photos)) if all(encoded[name][i] is not None for name in models)]
+    if not valid:
+        return results
+    user_embeddings = {name: torch.stack([encoded[name][i] for i in valid]).to(device) for name in models}
+
+    for photo_index, ranked in zip(valid, top_k_locations(user_embeddings, k=1, matrices=matrices)):
+        if not ranked:
+            results[photo_index] = (None, 0.0)
+            continue
+        # Find the best match from the combined scores
+        best_match_key, best_score = ranked[0]
+
+        print(f"Multi-Modal analysis complete. Best match: '{best_match_key}' with combined score {best_score:.2f}")
+
+        if best_score >= SIMILARITY_THRESHOLD:
+            results[photo_index] = (best_match_key, best_score)
+        else:
+            results[photo_index] = (None, best_score)
+    return results
 
 def find_best_match(user_photo_path):
     """
     Finds the best match by combining image-to-image and image-to-text similarity scores.
     """
-    # Generate embeddings for the user's photo from both models
-    user_embeddings = {name: get_image_embedding(user_photo_path, name) for name in models}
-
-    combined_scores = {}
-    for location_key in db_embeddings["image"]['laion'].keys(): # Iterate through all known locations
-        
-        # Get scores from each model and average them
-        scores_i2i, scores_i2t = [], []
-        for model_name in models:
-            user_emb = user_embeddings[model_name]
-            ref_img_emb = db_embeddings["image"][model_name].get(location_key)
-            ref_txt_emb = db_embeddings["text"][model_name].get(location_key)
-
-            if user_emb is not None:
-                if ref_img_emb is not None:
-                    scores_i2i.append(torch.nn.functional.cosine_similarity(user_emb, ref_img_emb).item())
-                if ref_txt_emb is not None:
-                    scores_i2t.append(torch.nn.functional.cosine_similarity(user_emb, ref_txt_emb).item())
-        
-        avg_i2i_score = sum(scores_i2i) / len(scores_i2i) if scores_i2i else 0
-        avg_i2t_score = sum(scores_i2t) / len(scores_i2t) if scores_i2t else 0
-
-        # Calculate the final weighted score
-        final_score = (avg_i2i_score * IMAGE_TO_IMAGE_WEIGHT) + (avg_i2t_score * IMAGE_TO_TEXT_WEIGHT)
-        combined_scores[location_key] = final_score
-
-    if not combined_scores:
-        return None, 0.0
-
-    # Find the best match from the combined scores
-    best_match_key = max(combined_scores, key=combined_scores.get)
-    best_score = combined_scores[best_match_key]
-
-    print(f"Multi-Modal analysis complete. Best match: '{best_match_key}' with combined score {best_score:.2f}")
-
-    if best_score >= SIMILARITY_THRESHOLD:
-        return best_match_key, best_score
-    else:
-        return None, best_score
+    return find_best_matches([user_photo_path])[0]
 
 # # File: matching_logic.py
 
@@ -0,0 +1,150 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from ..config import CHAT_PRESENCE_TTL_SECONDS, CHAT_PRESENCE_PERSIST_SECONDS
+
+# Who is online in chat. Presence lives in memory: a user is online while their heartbeats keep coming
+# (POST /chat/users/{id}/online, or an open chat WebSocket) and goes offline `ttl` seconds after the last
+# one. Status changes are pushed to subscribers and, every `persist_interval` seconds, written to disk in
+# one batch, so a burst of status flips costs a single write.
+
+
+class PresenceRegistry:
+    def __init__(self, ttl=CHAT_PRESENCE_TTL_SECONDS, persist_interval=CHAT_PRESENCE_PERSIST_SECONDS):
+        self.ttl = ttl
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._expires = {}  # user_id -> time.monotonic() deadline, for online users only
+        self._last_seen = {}  # user_id -> ISO 8601 time of the last heartbeat
+        self._dirty = set()  # Users whose status changed since the last write
+        self._subscribers = []
+        self._persist = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"heartbeats": 0, "changes": 0, "expired": 0, "writes": 0}
+
+    def subscribe(self, handler):
+        """`handler(user_id, is_online, last_seen)` is called (on any thread) whenever a user's status changes."""
+        self._subscribers.append(handler)
+
+    def set_persister(self, persist):
+        """`persist({user_id: (is_online, last_seen)})` saves a batch of status changes."""
+        self._persist = persist
+
+    def load(self, users):
+        """Starts from saved state (user directory entries); users saved as online get one TTL to check in."""
+        deadline = time.monotonic() + self.ttl
+        with self._lock:
+            for user in users:
+                if user.get("lastSeen"):
+                    self._last_seen[user["id"]] = user["lastSeen"]
+                if user.get("isOnline"):
+                    self._expires[user["id"]] = deadline
+
+    # --- Status ---
+    def heartbeat(self, user_id):
+        return self.set_status(user_id, True)
+
+    def set_status(self, user_id, is_online):
+        """Records a heartbeat (or an explicit sign-off). Returns True if the user's status changed."""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            was_online = user_id in self._expires
+            if is_online:
+                self._expires[user_id] = time.monotonic() + self.ttl
+                self._stats["heartbeats"] += 1
+            else:
+                self._expires.pop(user_id, None)
+            self._last_seen[user_id] = now
+            changed = was_online != is_online
+            if changed:
+                self._dirty.add(user_id)
+                self._stats["changes"] += 1
+        if changed:
+            self._notify(user_id, is_online, now)
+        return changed
+
+    def status(self, user_id):
+        """(is_online, last_seen) of a user; last_seen is None if they were never seen."""
+        with self._lock:
+            return user_id in self._expires, self._last_seen.get(user_id)
+
+    def online_user_ids(self):
+        with self._lock:
+            return list(self._expires)
+
+    def expire(self):
+        """Takes users whose heartbeats stopped offline. Returns their ids."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id, deadline in self._expires.items() if deadline <= now]
+            for user_id in expired:
+                del self._expires[user_id]
+                self._dirty.add(user_id)
+            self._stats["expired"] += len(expired)
+            self._stats["changes"] += len(expired)
+            changes = [(user_id, self._last_seen.get(user_id)) for user_id in expired]
+        for user_id, last_seen in changes:
+            self._notify(user_id, False, last_seen)
+        return expired
+
+    def _notify(self, user_id, is_online, last_seen):
+        for handler in list(self._subscribers):
+            try:
+                handler(user_id, is_online, last_seen)
+            except Exception as e:
+                print(f"Warning: Presence subscriber failed: {e}")
+
+    # --- Persistence ---
+    def persist(self):
+        """Writes the status changes since the last write, if any."""
+        if self._persist is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            changes = {user_id: (user_id in self._expires, self._last_seen.get(user_id)) for user_id in self._dirty}
+            self._dirty.clear()
+        try:
+            self._persist(changes)
+            self._stats["writes"] += 1
+        except Exception as e:
+            # Kept for the next attempt
+            print(f"Warning: Failed to save presence: {e}")
+            with self._lock:
+                self._dirty.update(changes)
+
+    # --- Background sweeper ---
+    def start(self):
+        """Starts expiring (and, with a persist interval, saving) presence on a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chat-presence", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        tick = max(0.5, min(self.ttl / 4, self.persist_interval or self.ttl))
+        next_write = time.monotonic() + self.persist_interval
+        while not self._stop.wait(tick):
+            self.expire()
+            if self.persist_interval > 0 and time.monotonic() >= next_write:
+                self.persist()
+                next_write = time.monotonic() + self.persist_interval
+
+    def stop(self):
+        """Stops the sweeper and saves what is left."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.persist_interval > 0:
+            self.persist()
+
+    def metrics(self):
+        with self._lock:
+            return {**self._stats, "online": len(self._expires), "pending_writes": len(self._dirty)}
+
+
+presence = PresenceRegistry()
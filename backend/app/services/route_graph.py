@@ -0,0 +1,161 @@
+import heapq
+import json
+import threading
+
+import numpy as np
+
+from ..config import NAV_CAMPUS_GRAPH_PATH
+
+# Campus routing. The campus is a weighted directed graph: nodes are places (locations users can be
+# matched to or navigate to, plus connectors such as corridors, doors, elevator landings and outdoor
+# paths), edges are the walks between them with a cost (roughly seconds) and the instruction shown to
+# the user. All-pairs shortest paths are precomputed into a next-hop table, so a route lookup just follows
+# next hops and costs O(path length).
+
+# Default instructions for edges that don't spell one out, by edge kind
+DEFAULT_INSTRUCTIONS = {
+    "walk": "Walk to {to}",
+    "door": "Go through to {to}",
+    "elevator": "Take the elevator to floor {floor}",
+    "stairs": "Take the stairs to floor {floor}",
+    "outdoor": "Walk across the campus to {to}",
+}
+
+
+class RouteNotFoundError(LookupError):
+    """Raised when a destination is unknown or can't be reached from the current location."""
+
+
+class CampusGraph:
+    """
+    A campus graph with precomputed all-pairs routes.
+
+    `nodes` maps node id -> {"name", "building", "floor", "location" (a location catalogue key or None)};
+    `edges` is a list of {"from", "to", "cost", "kind", "instruction", "reverse_instruction", "bidirectional"}.
+    Bidirectional edges (the default) are walkable both ways, using reverse_instruction going back.
+    """
+
+    def __init__(self, nodes, edges):
+        self.node_ids = list(nodes)
+        self.nodes = nodes
+        self._position = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self._by_location = {}
+        self._by_name = {}
+        for node_id, node in nodes.items():
+            if node.get("location"):
+                self._by_location[node["location"]] = self._position[node_id]
+                if node["name"] in self._by_name:
+                    raise ValueError(f"Two destinations are called '{node['name']}'.")
+                self._by_name[node["name"]] = self._position[node_id]
+
+        # Adjacency as (neighbour, cost, step text); only the cheapest edge between two nodes is kept
+        self._adjacency = [dict() for _ in self.node_ids]
+        for edge in edges:
+            for source, target, text in self._directions(edge):
+                best = self._adjacency[source].get(target)
+                if best is None or edge["cost"] < best[0]:
+                    self._adjacency[source][target] = (float(edge["cost"]), text)
+        self.next_hop, self.distance = self._all_pairs()
+
+    def _directions(self, edge):
+        for key in ("from", "to"):
+            if edge.get(key) not in self._position:
+                raise ValueError(f"Edge {edge} refers to unknown node '{edge.get(key)}'.")
+        if edge.get("cost", 0) < 0:
+            raise ValueError(f"Edge {edge} has a negative cost.")
+        source, target = self._position[edge["from"]], self._position[edge["to"]]
+        yield source, target, edge.get("instruction") or self._default_instruction(edge, target)
+        if edge.get("bidirectional", True):
+            yield target, source, edge.get("reverse_instruction") or self._default_instruction(edge, source)
+
+    def _default_instruction(self, edge, target):
+        node = self.nodes[self.node_ids[target]]
+        template = DEFAULT_INSTRUCTIONS.get(edge.get("kind", "walk"), DEFAULT_INSTRUCTIONS["walk"])
+        return template.format(to=node["name"], floor=node.get("floor", 0))
+
+    def _all_pairs(self):
+        """
+        Runs Dijkstra once per destination on the reversed graph. The shortest-path tree towards a
+        destination gives every node its next hop, stored as an (n, n) int32 table: next_hop[u, d] is the
+        node to move to from u on the way to d (-1 if d is unreachable from u).
+        """
+        count = len(self.node_ids)
+        reverse = [[] for _ in range(count)]
+        for source, targets in enumerate(self._adjacency):
+            for target, (cost, _) in targets.items():
+                reverse[target].append((source, cost))
+
+        next_hop = np.full((count, count), -1, dtype=np.int32)
+        distance = np.full((count, count), np.inf, dtype=np.float32)
+        for destination in range(count):
+            best = {destination: 0.0}
+            heap = [(0.0, destination)]
+            while heap:
+                cost, node = heapq.heappop(heap)
+                if cost > best[node]:
+                    continue
+                for previous, edge_cost in reverse[node]:
+                    candidate = cost + edge_cost
+                    if candidate < best.get(previous, float("inf")):
+                        best[previous] = candidate
+                        next_hop[previous, destination] = node
+                        heapq.heappush(heap, (candidate, previous))
+            for node, cost in best.items():
+                distance[node, destination] = cost
+        return next_hop, distance
+
+    def destinations(self):
+        """Human-readable names of every place that can be navigated to, in file order."""
+        return list(self._by_name)
+
+    def route(self, location_key, destination_name):
+        """Returns (step list, total cost) from a matched location to a destination name."""
+        if location_key not in self._by_location:
+            raise RouteNotFoundError(f"Location '{location_key}' is not on the campus map.")
+        if destination_name not in self._by_name:
+            raise RouteNotFoundError(f"Unknown destination '{destination_name}'.")
+        node, target = self._by_location[location_key], self._by_name[destination_name]
+        if node == target:
+            return ["You are already at your destination"], 0.0
+        if self.next_hop[node, target] < 0:
+            raise RouteNotFoundError(f"No route to '{destination_name}' from here.")
+
+        steps = []
+        while node != target:
+            hop = int(self.next_hop[node, target])
+            step = self._adjacency[node][hop][1]
+            # Consecutive identical steps (e.g. an elevator passing several floors) are shown once
+            if not steps or steps[-1] != step:
+                steps.append(step)
+            node = hop
+        return steps, float(self.distance[self._by_location[location_key], target])
+
+
+def load_campus_graph(path=NAV_CAMPUS_GRAPH_PATH):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return CampusGraph(data["nodes"], data["edges"])
+
+
+# --- Shared engine ---
+_route_engine = None
+_route_engine_lock = threading.Lock()
+
+def get_route_engine():
+    """Loads the campus graph and precomputes every route the first time it's needed."""
+    global _route_engine
+    if _route_engine is None:
+        with _route_engine_lock:
+            if _route_engine is None:
+                _route_engine = load_campus_graph()
+                print(f"Campus routes precomputed for {len(_route_engine.node_ids)} places.")
+    return _route_engine
+
+def reload_route_engine():
+    """Rebuilds the routes from the campus map file and swaps them in; lookups in flight keep the old table."""
+    global _route_engine
+    engine = load_campus_graph()
+    with _route_engine_lock:
+        _route_engine = engine
+    print(f"Campus routes reloaded for {len(engine.node_ids)} places.")
+    return engine
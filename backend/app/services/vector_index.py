@@ -0,0 +1,147 @@
+import numpy as np
+
+# Vector indexes for navigation matching, written in plain NumPy.
+# Every stored vector carries an integer label (the location it was taken at). Vectors and queries are
+# expected to be L2-normalized, so the inner product is the cosine similarity.
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, k):
+    """Row-wise top-k of a (batch, n) score matrix, best first. Returns (scores, column indices)."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.float32), np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return np.take_along_axis(candidate_scores, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+
+class VectorIndex:
+    """Common interface: search() finds the nearest stored vectors, label_scores() rolls them up per label."""
+
+    kind = None
+
+    def __init__(self, vectors, labels):
+        self.vectors = _normalize(vectors)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        if len(self.vectors) != len(self.labels):
+            raise ValueError("Every vector needs exactly one label.")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k):
+        """Returns (scores, ids), both (batch, k), best first. ids index into the stored vectors (-1 = no hit)."""
+        raise NotImplementedError
+
+    def label_scores(self, queries, num_labels, k, per_label_k=1):
+        """
+        Scores every label from the k nearest vectors: a label's score is the mean of its best
+        per_label_k hits. Labels with no hit in the top k get the lowest retrieved score, which is an upper
+        bound on what they would have scored. Returns a (batch, num_labels) float32 array.
+        """
+        scores, ids = self.search(queries, k)
+        result = np.zeros((scores.shape[0], num_labels), dtype=np.float32)
+        for row in range(scores.shape[0]):
+            hit = ids[row] >= 0
+            row_scores, row_labels = scores[row][hit], self.labels[ids[row][hit]]
+            if len(row_scores) == 0:
+                continue
+            # Hits are sorted best first, so a stable sort by label keeps each label's hits in score order
+            order = np.argsort(row_labels, kind="stable")
+            row_scores, row_labels = row_scores[order], row_labels[order]
+            starts = np.r_[0, np.flatnonzero(np.diff(row_labels)) + 1]
+            rank = np.arange(len(row_labels)) - np.repeat(starts, np.diff(np.r_[starts, len(row_labels)]))
+            keep = rank < per_label_k
+            sums = np.bincount(row_labels[keep], weights=row_scores[keep], minlength=num_labels)
+            counts = np.bincount(row_labels[keep], minlength=num_labels)
+            result[row] = row_scores.min()
+            found = counts > 0
+            result[row][found] = sums[found] / counts[found]
+        return result
+
+
+class FlatIndex(VectorIndex):
+    """Exact search: one matrix product against every stored vector."""
+
+    kind = "flat"
+
+    def search(self, queries, k):
+        return _top_k(_normalize(queries) @ self.vectors.T, k)
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index. Vectors are clustered with spherical k-means into nlist lists; a query only
+    scans the nprobe lists whose centroids are closest to it. Vectors are stored grouped by list so each
+    probed list is one contiguous slice.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, vectors, labels, nlist=None, nprobe=None, iterations=20, seed=0):
+        super().__init__(vectors, labels)
+        count = len(self.vectors)
+        self.nlist = max(1, min(count, nlist or int(round(np.sqrt(count)))))
+        self.nprobe = max(1, min(self.nlist, nprobe or max(1, self.nlist // 4)))
+        self.centroids = self._train(iterations, seed)
+
+        assignment = np.argmax(self.vectors @ self.centroids.T, axis=1) if count else np.empty(0, dtype=np.int64)
+        # A copy of the vectors grouped by list; _list_ids maps each grouped row back to its original id
+        self._list_ids = np.argsort(assignment, kind="stable")
+        self._list_vectors = self.vectors[self._list_ids]
+        self.offsets = np.r_[0, np.cumsum(np.bincount(assignment, minlength=self.nlist))]
+
+    def _train(self, iterations, seed):
+        if len(self.vectors) == 0:
+            return np.zeros((1, self.vectors.shape[1] if self.vectors.ndim == 2 else 0), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(len(self.vectors), self.nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(self.vectors @ centroids.T, axis=1)
+            updated = np.zeros_like(centroids)
+            np.add.at(updated, assignment, self.vectors)
+            empty = np.bincount(assignment, minlength=self.nlist) == 0
+            # Re-seed empty lists with random vectors so every list stays useful
+            updated[empty] = self.vectors[rng.choice(len(self.vectors), int(empty.sum()))]
+            updated = _normalize(updated)
+            if np.allclose(updated, centroids):
+                break
+            centroids = updated
+        return centroids
+
+    def search(self, queries, k):
+        queries = _normalize(queries)
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        _, probes = _top_k(queries @ self.centroids.T, self.nprobe)
+        for row, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            if len(rows) == 0:
+                continue
+            scores, picked = _top_k(queries[row:row + 1] @ self._list_vectors[rows].T, k)
+            found = scores.shape[1]
+            out_scores[row, :found] = scores[0]
+            out_ids[row, :found] = self._list_ids[rows[picked[0]]]
+        return out_scores, out_ids
+
+
+INDEX_TYPES = {"flat": FlatIndex, "ivf": IVFIndex}
+
+
+def build_index(kind, vectors, labels, **options):
+    """Builds an index by name ("flat" or "ivf")."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{kind}', expected one of {sorted(INDEX_TYPES)}.")
+    if kind == "flat":
+        return FlatIndex(vectors, labels)
+    return INDEX_TYPES[kind](vectors, labels, **options)
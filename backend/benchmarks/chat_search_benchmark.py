@@ -0,0 +1,123 @@
+"""
+Measures chat search latency on a synthetic message log.
+
+Builds a throwaway SQLite database with the chat tables and search index, fills it with messages drawn
+from a Zipf-distributed vocabulary (so some words are very common and most are rare), spread over many
+rooms, and then times /chat/search-style queries for a user who is in a handful of them: common words,
+rare words, two-word queries and unfinished (prefix) words.
+
+Run from the backend directory:
+    python -m benchmarks.chat_search_benchmark --messages 1000000 --rooms 500 --user-rooms 10
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.models import chat_models as models
+from app.services import chat_store
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words)
+
+
+def build_database(path, messages, rooms, vocabulary, rng, batch=20000):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=OFF")
+
+    models.Base.metadata.create_all(bind=engine, tables=[
+        models.ChatRoom.__table__, models.ChatParticipant.__table__, models.ChatMessage.__table__
+    ])
+    chat_store.create_search_index(engine)
+    room_ids = [f"room_{i}" for i in range(rooms)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(insert(models.ChatRoom), [
+            {"id": room_id, "name": room_id, "type": "group", "created_at": "2024-01-01T00:00:00+00:00"}
+            for room_id in room_ids
+        ])
+        for first in range(0, messages, batch):
+            rows = []
+            for seq in range(first, min(messages, first + batch)):
+                words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(4, 24))
+                rows.append({
+                    "id": f"m{seq}", "room_id": rng.choice(room_ids), "sender_id": str(rng.randint(1, 1000)),
+                    "content": " ".join(words), "timestamp": f"2024-01-01T00:00:00.{seq:09d}",
+                    "is_read": False, "message_type": "text",
+                })
+            connection.execute(insert(models.ChatMessage), rows)
+    return engine, room_ids, time.perf_counter() - started
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--user-rooms", type=int, default=10, help="rooms the searching user is in")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    with tempfile.TemporaryDirectory() as directory:
+        engine, room_ids, build_seconds = build_database(
+            os.path.join(directory, "chat.db"), args.messages, args.rooms, vocabulary, rng
+        )
+        session = sessionmaker(bind=engine)()
+        user_rooms = rng.sample(room_ids, min(args.user_rooms, len(room_ids)))
+        common, rare = vocabulary[:20], vocabulary[len(vocabulary) // 2:]
+        kinds = {
+            "common_word": lambda: rng.choice(common) + " ",
+            "rare_word": lambda: rng.choice(rare) + " ",
+            "two_words": lambda: f"{rng.choice(common)} {rng.choice(vocabulary[:2000])} ",
+            "prefix": lambda: rng.choice(vocabulary[:2000])[:3],
+        }
+        report = {
+            "messages": args.messages, "rooms": args.rooms, "user_rooms": len(user_rooms),
+            "build_seconds": round(build_seconds, 1), "queries": {},
+        }
+        for kind, make_query in kinds.items():
+            latencies, hits = [], 0
+            for _ in range(args.queries):
+                query = make_query()
+                started = time.perf_counter()
+                results, _ = chat_store.search_messages(session, user_rooms, query, args.limit)
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits += len(results)
+            report["queries"][kind] = {
+                "p50_ms": round(percentile(latencies, 0.5), 2),
+                "p95_ms": round(percentile(latencies, 0.95), 2),
+                "max_ms": round(max(latencies), 2),
+                "mean_results": round(hits / args.queries, 1),
+            }
+        session.close()
+        engine.dispose()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
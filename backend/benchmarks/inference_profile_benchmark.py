@@ -0,0 +1,178 @@
+"""
+Compares navigation inference profiles (NAV_PRECISION / NAV_MODELS / NAV_TORCH_THREADS) on CPU.
+
+Every profile runs in its own subprocess, so model memory and thread settings don't leak between them,
+with a throwaway embedding cache so reference photos are encoded with that profile. Queries are augmented
+copies of the database_photos set (see navigation_queries.py). For each profile it reports model load and
+warm-up time, per-upload latency, peak memory, accuracy, and top-1 agreement with the baseline profile
+(the first one, by default the fp32 two-model ensemble).
+
+Run from the backend directory:
+    python -m benchmarks.inference_profile_benchmark --threads 4
+    python -m benchmarks.inference_profile_benchmark --profiles fp32:laion,openai int8:laion --output profiles.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_PROFILES = [
+    "fp32:laion,openai",
+    "autocast:laion,openai",
+    "bf16:laion,openai",
+    "int8:laion,openai",
+    "fp32:laion",
+    "int8:laion",
+]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_child(args):
+    """Measures one profile in this process; the NAV_* settings were put in the environment by the parent."""
+    from app.services import navigation_service
+    from app.services.location_catalogue import load_location_catalogue
+    from benchmarks.navigation_queries import build_queries
+
+    catalogue = load_location_catalogue()
+    queries = build_queries(catalogue, args.photo_dir, args.per_photo, args.seed)
+
+    started = time.perf_counter()
+    navigation_service.load_models()
+    load_seconds = time.perf_counter() - started
+    rss_after_load = _peak_rss_mb()
+
+    started = time.perf_counter()
+    navigation_service.precompute_db_embeddings(catalogue, args.photo_dir, cache_path=args.cache_path)
+    index_seconds = time.perf_counter() - started
+
+    def match(image_bytes):
+        # The same work find_best_matches() does for a single upload, but keeps the top-1 below the threshold too
+        encoded = navigation_service.encode_images([image_bytes], batch_size=1, record_stats=False)
+        embeddings = {name: vectors[0].unsqueeze(0) for name, vectors in encoded.items()}
+        return navigation_service.top_k_locations(embeddings, k=1)[0][0]
+
+    for _, _, image_bytes in queries[:args.warmup]:
+        match(image_bytes)
+
+    latencies, predictions = [], []
+    for _, _, image_bytes in queries:
+        started = time.perf_counter()
+        location_key, score = match(image_bytes)
+        latencies.append((time.perf_counter() - started) * 1000)
+        matched = score >= navigation_service.SIMILARITY_THRESHOLD
+        predictions.append({"top1": location_key, "score": round(score, 4), "matched": matched})
+
+    latencies.sort()
+    result = {
+        "profile": dict(navigation_service.inference_profile),
+        "load_seconds": round(load_seconds, 2),
+        "index_seconds": round(index_seconds, 2),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 2),
+            "p95": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 2),
+            "mean": round(statistics.fmean(latencies), 2),
+        },
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": _peak_rss_mb(),
+        "labels": [location_key for location_key, _, _ in queries],
+        "predictions": predictions,
+    }
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+def run_profile(spec, args, workdir):
+    precision, _, model_names = spec.partition(":")
+    env = dict(
+        os.environ,
+        NAV_PRECISION=precision,
+        NAV_MODELS=model_names or "laion,openai",
+        NAV_TORCH_THREADS=str(args.threads),
+        NAV_EMBEDDING_CACHE_PATH=os.path.join(workdir, f"{spec.replace(':', '_').replace(',', '-')}.pt"),
+    )
+    result_path = os.path.join(workdir, "result.json")
+    command = [
+        sys.executable, "-m", "benchmarks.inference_profile_benchmark", "--child",
+        "--result", result_path, "--cache-path", env["NAV_EMBEDDING_CACHE_PATH"],
+        "--photo-dir", args.photo_dir, "--per-photo", str(args.per_photo), "--seed", str(args.seed),
+        "--warmup", str(args.warmup),
+    ]
+    completed = subprocess.run(command, env=env, capture_output=not args.verbose, text=True)
+    if completed.returncode != 0:
+        return {"spec": spec, "error": (completed.stderr or "").strip().splitlines()[-1:] or "failed"}
+    with open(result_path) as f:
+        return {"spec": spec, **json.load(f)}
+
+
+def summarize(results):
+    """Adds accuracy against the true locations and top-1 agreement with the baseline (first successful) profile."""
+    completed = [result for result in results if "error" not in result]
+    baseline_top1 = [p["top1"] for p in completed[0]["predictions"]] if completed else []
+    rows = []
+    for result in results:
+        if "error" in result:
+            rows.append(result)
+            continue
+        labels, predictions = result.pop("labels"), result.pop("predictions")
+        top1 = [p["top1"] for p in predictions]
+        rows.append({
+            **result,
+            "queries": len(labels),
+            "top1_accuracy": round(sum(p == l for p, l in zip(top1, labels)) / len(labels), 4),
+            "match_rate": round(sum(p["matched"] for p in predictions) / len(labels), 4),
+            "top1_agreement_with_baseline": round(sum(a == b for a, b in zip(top1, baseline_top1)) / len(labels), 4),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=DEFAULT_PROFILES,
+                        help="precision:model,model entries; the first one is the baseline")
+    parser.add_argument("--threads", type=int, default=0, help="NAV_TORCH_THREADS for every profile (0 = torch default)")
+    parser.add_argument("--photo-dir", default="app/database_photos")
+    parser.add_argument("--per-photo", type=int, default=2, help="augmented queries per reference photo")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the subprocesses' output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="nav-profiles-") as workdir:
+        results = []
+        for spec in args.profiles:
+            print(f"Running profile {spec}...", file=sys.stderr)
+            results.append(run_profile(spec, args, workdir))
+    report = {"threads": args.threads, "per_photo": args.per_photo, "profiles": summarize(results)}
+
+    print(f"{'profile':<24}{'applied':<10}{'p50 ms':>9}{'p95 ms':>9}{'peak MB':>9}{'top-1':>8}{'agree':>8}")
+    for row in report["profiles"]:
+        if "error" in row:
+            print(f"{row['spec']:<24}failed: {row['error']}")
+            continue
+        print(f"{row['spec']:<24}{row['profile']['precision']:<10}{row['latency_ms']['p50']:>9}{row['latency_ms']['p95']:>9}"
+              f"{row['peak_rss_mb']:>9}{row['top1_accuracy']:>8}{row['top1_agreement_with_baseline']:>8}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Speed and accuracy harness for navigation matching.
+
+Runs the real matcher over a labelled query set built from database_photos:
+  - augmented: phone-like copies of every reference photo (see navigation_queries.py)
+  - holdout:   every reference photo in turn, matched against the index without that photo
+
+and reports:
+  - single-upload latency (p50/p95/p99) of find_best_matches
+  - throughput and latency through the request batcher at several concurrency levels
+  - peak RSS
+  - top-1/top-3 accuracy overall and per location, for each query set
+  - a sweep of the image/text weight split (top-1/top-3) and of SIMILARITY_THRESHOLD
+    (how many uploads are accepted, and how many of those are right)
+
+Everything ends up in one JSON report. Pass --baseline with the report of an earlier release to fail
+(exit code 1) when accuracy drops or latency grows beyond the tolerances.
+
+Run from the backend directory:
+    python -m benchmarks.navigation_benchmark --output nav-report.json
+    python -m benchmarks.navigation_benchmark --baseline nav-report.json --concurrency 1 4
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {}
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "mean": round(statistics.fmean(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# --- Accuracy ---
+
+def embed(ns, photos):
+    """Query embeddings for every photo, per model, as (n, dim) tensors."""
+    encoded = ns.encode_images(photos, record_stats=False)
+    for name, vectors in encoded.items():
+        if any(vector is None for vector in vectors):
+            raise RuntimeError(f"Some query photos could not be decoded by model '{name}'.")
+    return {name: torch.stack(vectors).to(ns.device) for name, vectors in encoded.items()}
+
+
+def split_scores(ns, embeddings, matrices):
+    """Image-only and text-only (n, num_locations) scores, so any weight split can be blended afterwards."""
+    image = ns.score_locations(embeddings, matrices, weights=(1.0, 0.0)).cpu().numpy()
+    text = ns.score_locations(embeddings, matrices, weights=(0.0, 1.0)).cpu().numpy()
+    return image, text
+
+
+def holdout_matrices(ns, matrices, location_key, photo_index):
+    """The reference snapshot minus one photo (photo_index within its location's stack)."""
+    from app.services.vector_index import FlatIndex
+
+    label = matrices.location_keys.index(location_key)
+    image_index = {}
+    for name, index in matrices.image_index.items():
+        rows = np.flatnonzero(index.labels == label)
+        keep = np.ones(len(index), dtype=bool)
+        keep[rows[photo_index]] = False
+        image_index[name] = FlatIndex(index.vectors[keep], index.labels[keep])
+    return ns.ReferenceMatrices(matrices.location_keys, image_index, matrices.text, matrices.generation)
+
+
+def accuracy_report(location_keys, labels, image_scores, text_scores, image_weight, thresholds, weight_grid):
+    labels = np.array([location_keys.index(label) for label in labels])
+    blend = lambda w: w * image_scores + (1 - w) * text_scores
+
+    def ranks(scores):
+        order = np.argsort(-scores, axis=1)
+        return np.argmax(order == labels[:, None], axis=1)
+
+    scores = blend(image_weight)
+    rank = ranks(scores)
+    per_location = {}
+    for position, key in enumerate(location_keys):
+        mask = labels == position
+        if mask.any():
+            per_location[key] = {
+                "queries": int(mask.sum()),
+                "top1": round(float(np.mean(rank[mask] == 0)), 4),
+                "top3": round(float(np.mean(rank[mask] < 3)), 4),
+            }
+
+    best = scores.max(axis=1)
+    correct = rank == 0
+    threshold_sweep = []
+    for threshold in thresholds:
+        accepted = best >= threshold
+        threshold_sweep.append({
+            "threshold": round(threshold, 4),
+            "accepted": round(float(np.mean(accepted)), 4),
+            "precision": round(float(np.mean(correct[accepted])), 4) if accepted.any() else None,
+            "correct_accepted": round(float(np.mean(accepted & correct)), 4),
+            "wrong_accepted": round(float(np.mean(accepted & ~correct)), 4),
+        })
+
+    weight_sweep = []
+    for weight in weight_grid:
+        swept = ranks(blend(weight))
+        weight_sweep.append({
+            "image_weight": round(weight, 4),
+            "text_weight": round(1 - weight, 4),
+            "top1": round(float(np.mean(swept == 0)), 4),
+            "top3": round(float(np.mean(swept < 3)), 4),
+        })
+
+    return {
+        "queries": len(labels),
+        "top1": round(float(np.mean(rank == 0)), 4),
+        "top3": round(float(np.mean(rank < 3)), 4),
+        "per_location": per_location,
+        "threshold_sweep": threshold_sweep,
+        "weight_sweep": weight_sweep,
+    }
+
+
+def evaluate(ns, catalogue, args):
+    from benchmarks.navigation_queries import build_queries
+
+    matrices = ns.reference_matrices
+    image_weight = ns.IMAGE_TO_IMAGE_WEIGHT / (ns.IMAGE_TO_IMAGE_WEIGHT + ns.IMAGE_TO_TEXT_WEIGHT)
+    thresholds = list(np.arange(args.threshold_min, args.threshold_max + 1e-9, args.threshold_step))
+    weight_grid = list(np.linspace(0, 1, args.weight_steps))
+    results, sample_queries = {}, []
+
+    if "augmented" in args.query_sets:
+        queries = build_queries(catalogue, args.photo_dir, args.per_photo, args.seed)
+        sample_queries = [image_bytes for _, _, image_bytes in queries]
+        image, text = split_scores(ns, embed(ns, sample_queries), matrices)
+        results["augmented"] = accuracy_report(
+            matrices.location_keys, [key for key, _, _ in queries], image, text, image_weight, thresholds, weight_grid
+        )
+
+    if "holdout" in args.query_sets:
+        labels, image_rows, text_rows = [], [], []
+        first_index = next(iter(matrices.image_index.values()))
+        for position, location_key in enumerate(matrices.location_keys):
+            paths = [os.path.join(args.photo_dir, name) for name in catalogue[location_key]["image_files"]]
+            paths = [path for path in paths if os.path.exists(path)]
+            # A location's rows in the index follow its photo order; skip locations where that can't be lined
+            # up, and ones with a single photo (nothing would be left to match against)
+            if len(paths) < 2 or len(paths) != int(np.sum(first_index.labels == position)):
+                continue
+            embeddings = embed(ns, paths)
+            for photo_index in range(len(paths)):
+                held_out = holdout_matrices(ns, matrices, location_key, photo_index)
+                image, text = split_scores(ns, {n: e[photo_index:photo_index + 1] for n, e in embeddings.items()}, held_out)
+                labels.append(location_key)
+                image_rows.append(image[0])
+                text_rows.append(text[0])
+        if labels:
+            results["holdout"] = accuracy_report(
+                matrices.location_keys, labels, np.stack(image_rows), np.stack(text_rows), image_weight, thresholds, weight_grid
+            )
+    return results, sample_queries
+
+
+# --- Speed ---
+
+def single_latency(ns, photos, warmup):
+    for photo in photos[:warmup]:
+        ns.find_best_matches([photo])
+    samples = []
+    for photo in photos:
+        started = time.perf_counter()
+        ns.find_best_matches([photo])
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
+
+
+async def _drive(batcher, photos, concurrency, total):
+    latencies, next_index = [], 0
+
+    async def client():
+        nonlocal next_index
+        while next_index < total:
+            photo = photos[next_index % len(photos)]
+            next_index += 1
+            started = time.perf_counter()
+            await batcher.submit(photo)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    metrics = batcher.metrics()
+    await batcher.shutdown()
+    return elapsed, latencies, metrics
+
+
+def concurrent_throughput(ns, photos, levels, total):
+    """Pushes `total` uploads through a fresh request batcher per concurrency level, like the API does."""
+    from app.services.navigation_batcher import InferenceBatcher
+
+    report = []
+    for concurrency in levels:
+        batcher = InferenceBatcher(ns.find_best_matches, max_queue_depth=max(concurrency, 1) * 2)
+        elapsed, latencies, metrics = asyncio.run(_drive(batcher, photos, concurrency, total))
+        report.append({
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "latency_ms": percentiles(latencies),
+            "avg_batch_size": metrics["avg_batch_size"],
+        })
+    return report
+
+
+# --- Regression check ---
+
+def compare(report, baseline, accuracy_tolerance, latency_tolerance):
+    """Lists every metric that got worse than the baseline by more than the tolerance."""
+    regressions = []
+    for query_set, accuracy in report["accuracy"].items():
+        old = baseline.get("accuracy", {}).get(query_set)
+        if not old:
+            continue
+        for metric in ("top1", "top3"):
+            if accuracy[metric] < old[metric] - accuracy_tolerance:
+                regressions.append(f"{query_set} {metric}: {old[metric]} -> {accuracy[metric]}")
+    old_latency = baseline.get("latency_ms", {})
+    for metric in ("p50", "p95"):
+        if metric in old_latency and report["latency_ms"][metric] > old_latency[metric] * (1 + latency_tolerance):
+            regressions.append(f"latency {metric}: {old_latency[metric]}ms -> {report['latency_ms'][metric]}ms")
+    return regressions
+
+
+def run(ns, catalogue, args, cache_path):
+    started = time.perf_counter()
+    ns.precompute_db_embeddings(catalogue, args.photo_dir, cache_path=cache_path)
+    warm_up_seconds = time.perf_counter() - started
+
+    accuracy, queries = evaluate(ns, catalogue, args)
+    if not queries:
+        queries = [os.path.join(args.photo_dir, name) for data in catalogue.values() for name in data["image_files"]]
+
+    return {
+        "profile": dict(ns.inference_profile),
+        "settings": {
+            "similarity_threshold": ns.SIMILARITY_THRESHOLD,
+            "image_to_image_weight": ns.IMAGE_TO_IMAGE_WEIGHT,
+            "image_to_text_weight": ns.IMAGE_TO_TEXT_WEIGHT,
+            "locations": len(ns.reference_matrices.location_keys),
+            "reference_photos": len(next(iter(ns.reference_matrices.image_index.values()), [])),
+        },
+        "warm_up_seconds": round(warm_up_seconds, 2),
+        "latency_ms": single_latency(ns, queries, args.warmup),
+        "throughput": concurrent_throughput(ns, queries, args.concurrency, args.requests or len(queries)),
+        "accuracy": accuracy,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photo-dir", default=None, help="defaults to NAV_PHOTOS_DIR")
+    parser.add_argument("--cache-path", default=None, help="embedding cache to use (defaults to NAV_EMBEDDING_CACHE_PATH)")
+    parser.add_argument("--query-sets", nargs="+", choices=["augmented", "holdout"], default=["augmented", "holdout"])
+    parser.add_argument("--per-photo", type=int, default=2, help="augmented queries per reference photo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=0, help="uploads per concurrency level (default: one per query)")
+    parser.add_argument("--threshold-min", type=float, default=0.15)
+    parser.add_argument("--threshold-max", type=float, default=0.40)
+    parser.add_argument("--threshold-step", type=float, default=0.025)
+    parser.add_argument("--weight-steps", type=int, default=11, help="image weights from 0 to 1 to try")
+    parser.add_argument("--output", help="write the JSON report here (it is always printed)")
+    parser.add_argument("--baseline", help="an earlier report; exit with code 1 on regressions")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.02)
+    parser.add_argument("--latency-tolerance", type=float, default=0.25, help="allowed relative latency increase")
+    args = parser.parse_args()
+
+    from app.config import NAV_PHOTOS_DIR, NAV_EMBEDDING_CACHE_PATH
+    from app.services import navigation_service as ns
+    from app.services.location_catalogue import load_location_catalogue
+
+    args.photo_dir = args.photo_dir or NAV_PHOTOS_DIR
+    catalogue = load_location_catalogue()
+    # The service logs every match to stdout; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(ns, catalogue, args, args.cache_path or NAV_EMBEDDING_CACHE_PATH)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.accuracy_tolerance, args.latency_tolerance)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Query photos for the navigation benchmarks.
+
+Matching a reference photo against itself says little, so every photo in database_photos is turned into
+a few "user uploads": a random crop, a small rotation, a lighting change, a downscale and a JPEG
+re-encode, roughly what a phone picture of the same spot looks like. Seeded, so every run (and every
+benchmark subprocess) sees exactly the same queries.
+"""
+import io
+import os
+import random
+
+from PIL import Image, ImageEnhance
+
+
+def augment(image, rng):
+    width, height = image.size
+    scale = rng.uniform(0.7, 0.9)
+    crop_w, crop_h = int(width * scale), int(height * scale)
+    left, top = rng.randint(0, width - crop_w), rng.randint(0, height - crop_h)
+    image = image.crop((left, top, left + crop_w, top + crop_h))
+    image = image.rotate(rng.uniform(-8, 8), resample=Image.BILINEAR)
+    image = ImageEnhance.Brightness(image).enhance(rng.uniform(0.7, 1.3))
+    image = ImageEnhance.Contrast(image).enhance(rng.uniform(0.8, 1.2))
+    image.thumbnail((rng.choice([480, 640, 1024]),) * 2)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=rng.choice([60, 75, 90]))
+    return buffer.getvalue()
+
+
+def build_queries(location_data, photo_dir, per_photo=2, seed=0):
+    """Returns a list of (location_key, source filename, JPEG bytes), per_photo queries for every photo."""
+    rng = random.Random(seed)
+    queries = []
+    for location_key, data in location_data.items():
+        for filename in data["image_files"]:
+            path = os.path.join(photo_dir, filename)
+            if not os.path.exists(path):
+                continue
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+                for _ in range(per_photo):
+                    queries.append((location_key, filename, augment(image, rng)))
+    return queries
@@ -0,0 +1,165 @@
+"""
+Measures how server memory grows with the number of workers (Linux only, reads /proc).
+
+For every worker count it starts the server, waits until it's ready, sends a few navigation requests so
+every worker has run inference, and then adds up RSS, PSS and USS over the whole process tree. PSS splits
+shared pages between the processes that share them, so its total is the real memory cost. With
+app.serve (fork-after-load) the total PSS should grow by much less than one model copy per worker.
+--compare-uvicorn runs `uvicorn --workers N` as well, where every worker loads its own models.
+
+Run from the backend directory:
+    python -m benchmarks.serving_memory_benchmark --workers 1 2 4 --compare-uvicorn --output memory.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def memory_kb(pid):
+    """Rss, Pss and Uss (private clean + dirty) of one process, from smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def post_photo(url, path, destination):
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        photo = f.read()
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"destination\"\r\n\r\n{destination}\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"photo.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + photo + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_ready(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready.")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health/ready", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(1)
+    raise TimeoutError("Server did not become ready in time.")
+
+
+def measure(runner, workers, args):
+    port = free_port()
+    if runner == "serve":
+        command = [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--workers", str(workers), "--port", str(port), "--log-level", "warning"]
+    env = dict(os.environ, NAVIGATION_MODE="eager")
+    started = time.monotonic()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, process, args.timeout)
+        # uvicorn workers become ready one by one; give the rest a moment before sending traffic
+        time.sleep(args.settle)
+        startup_seconds = time.monotonic() - started
+        statuses = [post_photo(f"{base_url}/navigation/find-path/", args.photo, args.destination)
+                    for _ in range(args.requests * workers)]
+        pids = process_tree(process.pid)
+        per_process = [memory_kb(pid) for pid in pids]
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    total = {key: round(sum(p[key] for p in per_process) / 1024, 1) for key in ("rss", "pss", "uss")}
+    return {
+        "runner": runner,
+        "workers": workers,
+        "processes": len(pids),
+        "startup_seconds": round(startup_seconds, 1),
+        "requests_ok": sum(status == 200 for status in statuses),
+        "requests": len(statuses),
+        "total_rss_mb": total["rss"],
+        "total_pss_mb": total["pss"],
+        "total_uss_mb": total["uss"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--compare-uvicorn", action="store_true", help="also measure `uvicorn --workers N`")
+    parser.add_argument("--requests", type=int, default=4, help="navigation requests per worker before measuring")
+    parser.add_argument("--photo", default="app/database_photos/NMIMS_Cafeteria.jpg")
+    parser.add_argument("--destination", default="ACE Event Hall")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for the server to be ready")
+    parser.add_argument("--settle", type=float, default=5, help="seconds to wait after the first ready response")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the servers' logs")
+    args = parser.parse_args()
+
+    runners = ["serve"] + (["uvicorn"] if args.compare_uvicorn else [])
+    results = []
+    for runner in runners:
+        for workers in args.workers:
+            print(f"Measuring {runner} with {workers} workers...", file=sys.stderr)
+            results.append(measure(runner, workers, args))
+    # How much each extra worker costs, relative to the smallest worker count measured
+    for runner in runners:
+        rows = [row for row in results if row["runner"] == runner]
+        base = min(rows, key=lambda row: row["workers"])
+        for row in rows:
+            extra = row["workers"] - base["workers"]
+            row["pss_mb_per_extra_worker"] = round((row["total_pss_mb"] - base["total_pss_mb"]) / extra, 1) if extra else None
+
+    output = json.dumps({"results": results}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares the approximate (IVF) navigation photo index against exact flat search.
+
+Builds a synthetic campus of clustered, CLIP-sized embeddings (several views per location), then reports
+for each nprobe setting: recall@k of the nearest photos, how often the best location agrees with exact
+search, and per-query latency.
+
+Run from the backend directory:
+    python -m benchmarks.vector_index_benchmark --locations 2000 --views 6 --nprobe 1 4 8 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.vector_index import FlatIndex, IVFIndex
+
+
+def make_dataset(locations, views, dim, queries, view_noise, query_noise, seed):
+    """Each location is a random direction; its photos and the queries are noisy copies of it."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(locations, dim))
+    labels = np.repeat(np.arange(locations), views)
+    vectors = centers[labels] + view_noise * rng.normal(size=(len(labels), dim))
+    query_labels = rng.integers(0, locations, queries)
+    query_vectors = centers[query_labels] + query_noise * rng.normal(size=(queries, dim))
+    return vectors, labels, query_vectors, query_labels
+
+
+def timed_search(index, queries, k):
+    """Searches one query at a time (like a single upload) and returns the mean latency in ms."""
+    results, started = [], time.perf_counter()
+    for row in range(len(queries)):
+        results.append(index.search(queries[row:row + 1], k))
+    elapsed = time.perf_counter() - started
+    scores = np.concatenate([scores for scores, _ in results])
+    ids = np.concatenate([ids for _, ids in results])
+    return scores, ids, elapsed / len(queries) * 1000
+
+
+def run(args):
+    vectors, labels, queries, query_labels = make_dataset(
+        args.locations, args.views, args.dim, args.queries, args.view_noise, args.query_noise, args.seed
+    )
+    flat = FlatIndex(vectors, labels)
+    _, exact_ids, flat_ms = timed_search(flat, queries, args.k)
+    exact_locations = flat.label_scores(queries, args.locations, len(flat)).argmax(axis=1)
+
+    report = {
+        "photos": len(vectors),
+        "locations": args.locations,
+        "dim": args.dim,
+        "k": args.k,
+        "flat": {
+            "ms_per_query": round(flat_ms, 3),
+            "location_accuracy": round(float(np.mean(exact_locations == query_labels)), 4),
+        },
+        "ivf": [],
+    }
+
+    started = time.perf_counter()
+    ivf = IVFIndex(vectors, labels, nlist=args.nlist or None)
+    build_seconds = time.perf_counter() - started
+    for nprobe in args.nprobe:
+        ivf.nprobe = max(1, min(ivf.nlist, nprobe))
+        _, approx_ids, ivf_ms = timed_search(ivf, queries, args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(exact_ids, approx_ids)])
+        approx_locations = ivf.label_scores(queries, args.locations, args.k).argmax(axis=1)
+        report["ivf"].append({
+            "nlist": ivf.nlist,
+            "nprobe": ivf.nprobe,
+            "build_seconds": round(build_seconds, 3),
+            "ms_per_query": round(ivf_ms, 3),
+            "speedup": round(flat_ms / ivf_ms, 2) if ivf_ms else None,
+            f"recall@{args.k}": round(float(recall), 4),
+            "location_agreement": round(float(np.mean(approx_locations == exact_locations)), 4),
+            "location_accuracy": round(float(np.mean(approx_locations == query_labels)), 4),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--views", type=int, default=6, help="Reference photos per location")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="Nearest photos retrieved per query")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = sqrt(photos))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--view-noise", type=float, default=0.6)
+    parser.add_argument("--query-noise", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import Future
+
+from app.services.chat_attachments import AttachmentStorage
+
+
+class _FinishedExecutor:
+    """Runs each job as it is submitted, like a worker that finishes before submit() returns."""
+
+    def submit(self, job, *args):
+        future = Future()
+        try:
+            future.set_result(job(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_request_thumbnail_returns_when_the_job_fails_at_once(tmp_path):
+    storage = AttachmentStorage(root=str(tmp_path))
+    storage._executor = _FinishedExecutor()
+    sha256 = "ab" * 32
+    (tmp_path / "blobs" / sha256[:2]).mkdir(parents=True)
+    with open(storage.blob_path(sha256), "wb") as f:
+        f.write(b"not an image")
+
+    futures = []
+    # A thread, so a deadlock fails the test instead of hanging it
+    worker = threading.Thread(target=lambda: futures.append(storage.request_thumbnail(sha256)), daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive(), "request_thumbnail deadlocked"
+    assert futures[0].exception() is not None
+    assert storage.metrics()["thumbnail_failures"] == 1
+    assert storage.metrics()["thumbnails_pending"] == 0
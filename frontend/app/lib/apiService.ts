@@ -541,6 +541,25 @@ export const apiService = {
     }
   },
 
+  uploadChatAttachment: async (file: File, userId: string) => {
+    try {
+      const formData = new FormData();
+      formData.append('file', file);
+      const response = await fetch(`${API_URL}/chat/attachments?user_id=${encodeURIComponent(userId)}`, {
+        method: 'POST',
+        body: formData,
+      });
+      const data = await response.json();
+      if (!response.ok) {
+        return { success: false, message: data.detail || 'Failed to upload attachment.' };
+      }
+      return { success: true, data: data.data, message: 'Attachment uploaded successfully.' };
+    } catch (error) {
+      console.error("API Error (uploadChatAttachment):", error);
+      return { success: false, message: 'A network error occurred.' };
+    }
+  },
+
   getOnlineUsers: async () => {
     try {
       const response = await fetch(`${API_URL}/chat/users/online`);
@@ -591,9 +610,9 @@ export const apiService = {
     }
   },
 
-  markMessageRead: async (messageId: string) => {
+  markMessageRead: async (messageId: string, userId: string) => {
     try {
-      const response = await fetch(`${API_URL}/chat/messages/${messageId}/read`, {
+      const response = await fetch(`${API_URL}/chat/messages/${messageId}/read?user_id=${encodeURIComponent(userId)}`, {
         method: 'POST',
       });
       const data = await response.json();
@@ -606,5 +625,23 @@ export const apiService = {
       return { success: false, message: 'A network error occurred.' };
     }
   },
+
+  markRoomRead: async (roomId: string, userId: string, upTo?: string) => {
+    try {
+      const params = new URLSearchParams({ user_id: userId });
+      if (upTo) params.set('up_to', upTo);
+      const response = await fetch(`${API_URL}/chat/rooms/${roomId}/read?${params}`, {
+        method: 'POST',
+      });
+      const data = await response.json();
+      if (!response.ok) {
+        return { success: false, message: data.detail || 'Failed to mark messages as read.' };
+      }
+      return { success: true, data: data.data, message: 'Messages marked as read.' };
+    } catch (error) {
+      console.error("API Error (markRoomRead):", error);
+      return { success: false, message: 'A network error occurred.' };
+    }
+  },
   
 };
\ No newline at end of file